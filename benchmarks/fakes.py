@@ -0,0 +1,431 @@
+"""
+Local stand-ins for the services the bot talks to, so the benchmarks run offline:
+a fake Telegram Bot API, a minimal MQTT broker and a simulated ICMP responder.
+"""
+
+import time
+import random
+import asyncio
+from aiohttp import web
+
+# MQTT 3.1.1 control packet types
+CONNECT = 1
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+UNSUBSCRIBE = 10
+PINGREQ = 12
+DISCONNECT = 14
+
+MEMBERS = ("benji", "owen", "mohammad", "night", "weekend")
+
+
+class FakeBotAPI(object):
+    """
+    FakeBotAPI class which answers the Bot API methods the bot calls, after a set latency,
+    and answers a share of sendMessage calls with flood control (HTTP 429).
+    """
+
+    def __init__(
+        self,
+        latency: float = 0,
+        throttle: float = 0,
+        retry_after: int = 1,
+        seed: int = 0,
+    ):
+        """
+        Initialises the FakeBotAPI with nothing polled yet.
+
+        Parameters
+        ----------
+        latency: float
+            Seconds added to every call, to stand in for the round trip to Telegram.
+        throttle: float
+            Share of sendMessage calls answered with 429, between 0 and 1.
+        retry_after: int
+            Seconds the 429 answers ask the bot to wait.
+        seed: int
+            Seed of the random choice of which calls are throttled.
+        """
+        self.latency = latency
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.polled = asyncio.Event()
+        self.calls = {}
+        self.throttled = 0
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        """
+        Answers one Bot API call, holding getUpdates briefly like a long poll with no updates.
+
+        Parameters
+        ----------
+        request: Request
+            The request object.
+        """
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        await asyncio.sleep(self.latency)
+        if method == "getMe":
+            result = {
+                "id": 123,
+                "is_bot": True,
+                "first_name": "Bench",
+                "username": "bench_bot",
+            }
+        elif method == "getUpdates":
+            self.polled.set()
+            await asyncio.sleep(0.5)
+            result = []
+        elif method == "sendMessage":
+            if self.throttle and self.random.random() < self.throttle:
+                self.throttled += 1
+                return web.json_response(
+                    {
+                        "ok": False,
+                        "error_code": 429,
+                        "description": f"Too Many Requests: retry after {self.retry_after}",
+                        "parameters": {"retry_after": self.retry_after},
+                    },
+                    status=429,
+                )
+            result = {
+                "message_id": self.calls[method],
+                "date": int(time.time()),
+                "chat": {"id": 1, "type": "private"},
+                "text": "",
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def reset(self):
+        """
+        Forgets the calls counted so far.
+        """
+        self.polled.clear()
+        self.calls = {}
+        self.throttled = 0
+
+    async def start(self):
+        """
+        Starts the server on a free local port.
+        """
+        server = web.Application()
+        server.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(server)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+
+    async def stop(self):
+        """
+        Stops the server.
+        """
+        await self.runner.cleanup()
+
+
+def encode_length(length: int):
+    """
+    Function to encode an MQTT remaining length.
+
+    Parameters
+    ----------
+    length: int
+        The number of bytes after the fixed header.
+
+    Returns
+    -------
+    bytes
+        The length in one to four bytes, seven bits each.
+    """
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def topic_matches(topic_filter: str, topic: str):
+    """
+    Function to check a topic against a subscription's filter, with + and # wildcards.
+
+    Parameters
+    ----------
+    topic_filter: str
+        The filter, shared subscriptions ($share/<group>/...) are matched on the filter after the group.
+    topic: str
+        The topic a message was published on.
+
+    Returns
+    -------
+    bool
+        True if the filter matches the topic.
+    """
+    if topic_filter.startswith("$share/"):
+        topic_filter = topic_filter.split("/", 2)[2]
+    levels = topic.split("/")
+    for i, level in enumerate(topic_filter.split("/")):
+        if level == "#":
+            return True
+        if i >= len(levels) or (level != "+" and level != levels[i]):
+            return False
+    return len(levels) == len(topic_filter.split("/"))
+
+
+class Session(object):
+    """
+    Session class which holds one connected client's subscriptions and its window of unacknowledged messages.
+    """
+
+    def __init__(self, writer, inflight: int):
+        """
+        Initialises the Session with no subscriptions.
+
+        Parameters
+        ----------
+        writer: StreamWriter
+            The client's connection.
+        inflight: int
+            Maximum number of QoS 1 messages sent to the client and not yet acknowledged.
+        """
+        self.writer = writer
+        self.filters = []
+        self.window = asyncio.Semaphore(inflight)
+        self.packet_id = 0
+
+
+class MqttBroker(object):
+    """
+    MqttBroker class, a minimal in-process MQTT 3.1.1 broker which accepts any client, keeps subscriptions in memory
+    and delivers what is published to it with QoS 1, like Mosquitto with its default limit of 20 messages in flight.
+    Retained messages, wills and stored sessions are not supported.
+    """
+
+    def __init__(self, inflight: int = 20):
+        """
+        Initialises the MqttBroker with no clients.
+
+        Parameters
+        ----------
+        inflight: int
+            Maximum number of unacknowledged messages per client.
+        """
+        self.inflight = inflight
+        self.sessions = set()
+        self.subscribed = asyncio.Event()
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        """
+        Starts listening on a free local port.
+        """
+        self.server = await asyncio.start_server(self.serve, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """
+        Disconnects every client and stops listening.
+        """
+        for session in list(self.sessions):
+            session.writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def serve(self, reader, writer):
+        """
+        Handles one client's packets until it disconnects.
+
+        Parameters
+        ----------
+        reader: StreamReader
+            The client's connection.
+        writer: StreamWriter
+            The client's connection.
+        """
+        session = Session(writer, self.inflight)
+        self.sessions.add(session)
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                length, shift = 0, 0
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                kind = header >> 4
+                if kind == CONNECT:
+                    writer.write(b"\x20\x02\x00\x00")  # CONNACK, accepted
+                elif kind == SUBSCRIBE:
+                    granted = bytearray()
+                    i = 2
+                    while i < len(body):
+                        size = int.from_bytes(body[i : i + 2], "big")
+                        session.filters.append(body[i + 2 : i + 2 + size].decode())
+                        granted.append(min(body[i + 2 + size], 1))
+                        i += 3 + size
+                    writer.write(
+                        b"\x90" + encode_length(2 + len(granted)) + body[:2] + granted
+                    )
+                    self.subscribed.set()
+                elif kind == UNSUBSCRIBE:
+                    writer.write(b"\xb0\x02" + body[:2])
+                elif kind == PUBACK:
+                    session.window.release()
+                elif kind == PINGREQ:
+                    writer.write(b"\xd0\x00")
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    async def publish(self, topic: str, payload: bytes):
+        """
+        Delivers a message with QoS 1 to every matching subscription, waiting while a client's window is full.
+
+        Parameters
+        ----------
+        topic: str
+            The topic.
+        payload: bytes
+            The message.
+        """
+        for session in list(self.sessions):
+            if not any(topic_matches(f, topic) for f in session.filters):
+                continue
+            await session.window.acquire()
+            session.packet_id = session.packet_id % 0xFFFF + 1
+            encoded = topic.encode()
+            body = (
+                len(encoded).to_bytes(2, "big")
+                + encoded
+                + session.packet_id.to_bytes(2, "big")
+                + payload
+            )
+            session.writer.write(b"\x32" + encode_length(len(body)) + body)
+            await session.writer.drain()
+
+
+def blueiris_payloads(count: int, members: tuple = MEMBERS):
+    """
+    Function to make BlueIris-style login and logout payloads, each member logging in then out in turn.
+
+    Parameters
+    ----------
+    count: int
+        Number of payloads.
+    members: tuple
+        Names of the members.
+
+    Returns
+    -------
+    list
+        The payloads, such as b"Benji logged in".
+    """
+    payloads = []
+    for i in range(count):
+        name = members[i % len(members)].capitalize()
+        state = "in" if (i // len(members)) % 2 == 0 else "out"
+        payloads.append(f"{name} logged {state}".encode())
+    return payloads
+
+
+async def publish_at(broker, topic: str, payloads: list, rate: float = 0):
+    """
+    Function to publish payloads at a set rate.
+
+    Parameters
+    ----------
+    broker: MqttBroker
+        The broker to publish through.
+    topic: str
+        The topic.
+    payloads: list
+        The payloads, in order.
+    rate: float
+        Messages per second, as fast as the clients acknowledge them if 0.
+
+    Returns
+    -------
+    float
+        Seconds publishing took.
+    """
+    start = time.perf_counter()
+    for i, payload in enumerate(payloads):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await broker.publish(topic, payload)
+    return time.perf_counter() - start
+
+
+class FakeIcmp(object):
+    """
+    FakeIcmp class which stands in for the IcmpMultiplexer, answering echoes after a simulated round trip
+    and losing a share of them.
+    """
+
+    def __init__(
+        self, rtt: float = 0.02, jitter: float = 0.005, loss: float = 0, seed: int = 0
+    ):
+        """
+        Initialises the FakeIcmp.
+
+        Parameters
+        ----------
+        rtt: float
+            Mean round trip time in seconds.
+        jitter: float
+            Standard deviation of the round trip time in seconds.
+        loss: float
+            Share of echoes lost, between 0 and 1.
+        seed: int
+            Seed of the simulated round trips and losses.
+        """
+        self.rtt = rtt
+        self.jitter = jitter
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.echoes = 0
+
+    async def ping(self, host: str, timeout: float = 1):
+        """
+        Function to simulate one echo, with the same interface as IcmpMultiplexer.ping.
+
+        Parameters
+        ----------
+        host: str
+            The host, not used.
+        timeout: float
+            Seconds a lost echo waits before giving up.
+
+        Returns
+        -------
+        float or None
+            Round trip time in seconds, None if the echo was lost.
+        """
+        self.echoes += 1
+        if self.random.random() < self.loss:
+            await asyncio.sleep(timeout)
+            return None
+        rtt = max(self.random.gauss(self.rtt, self.jitter), 0)
+        if rtt > timeout:
+            await asyncio.sleep(timeout)
+            return None
+        await asyncio.sleep(rtt)
+        return rtt
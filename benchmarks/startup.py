@@ -0,0 +1,244 @@
+"""
+Startup benchmark, which spawns the bot against a local fake Telegram Bot API and measures how long it takes
+to start polling and to report ready on /readyz, then how long it takes to stop on SIGTERM.
+
+    python benchmarks/startup.py --runs 10 --latency 0.1
+    python benchmarks/startup.py --source /path/to/older/telegrambot
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import asyncio
+import argparse
+import tempfile
+import statistics
+from aiohttp import ClientSession, ClientError
+from fakes import FakeBotAPI
+
+SOURCE = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.pardir, "telegrambot")
+)
+TOKEN = "123:fake"
+TIMEOUT = 30
+GRACE = 2  # seconds after the first poll for updates /readyz is waited for and the bot is stopped
+
+
+def free_port():
+    """
+    Function to find a free local TCP port.
+
+    Returns
+    -------
+    int
+        The port.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(url: str, proc, polled: asyncio.Event):
+    """
+    Function to poll /readyz until it answers 200, older releases have none. Polling only starts
+    once the bot polls for updates, so it does not slow the startup it is timing.
+
+    Parameters
+    ----------
+    url: str
+        The /readyz URL.
+    proc: Process
+        The bot process, polling stops if it exits.
+    polled: Event
+        Set once the bot polls for updates.
+
+    Returns
+    -------
+    bool
+        True once ready, False if the bot has no /readyz, exited or was not ready within GRACE seconds.
+    """
+    await polled.wait()
+    give_up = time.monotonic() + GRACE
+    async with ClientSession() as session:
+        while proc.returncode is None and time.monotonic() < give_up:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return True
+                    if response.status == 404:
+                        return False
+            except ClientError:
+                pass
+            await asyncio.sleep(0.01)
+    return False
+
+
+async def timed(awaitable, start: float):
+    """
+    Function to time how long after a start an awaitable finished.
+
+    Parameters
+    ----------
+    awaitable: awaitable
+        What to wait for, it did not happen if it returns False.
+    start: float
+        perf_counter value to time from.
+
+    Returns
+    -------
+    float
+        Seconds from the start, None if it did not happen.
+    """
+    if await awaitable is False:
+        return None
+    return time.perf_counter() - start
+
+
+async def run_once(api, source: str):
+    """
+    Function to start the bot once in an empty directory, wait for it to be ready, then stop it.
+
+    Parameters
+    ----------
+    api: FakeBotAPI
+        The fake Bot API the bot talks to.
+    source: str
+        Directory bot.py is in.
+
+    Returns
+    -------
+    dict
+        Seconds until the first poll, until /readyz answered 200 (None if it never did)
+        and to stop once signalled.
+    """
+    api.reset()
+    port = free_port()
+    env = {
+        key: value for key, value in os.environ.items() if not key.startswith("CCTV_")
+    }
+    env.update(
+        TOKEN=TOKEN,
+        TELEGRAM_API_URL=api.url,
+        HTTP_PORT=str(port),
+    )
+    with tempfile.TemporaryDirectory() as cwd:
+        for name in ("hosts.json", "subscribers.json"):
+            with open(os.path.join(cwd, name), "w") as file:
+                json.dump({}, file)
+        with open(os.path.join(cwd, "bot.log"), "w") as log:
+            start = time.perf_counter()
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable,
+                os.path.join(source, "bot.py"),
+                cwd=cwd,
+                env=env,
+                stdout=log,
+                stderr=log,
+            )
+            try:
+                polled, ready = await asyncio.wait_for(
+                    asyncio.gather(
+                        timed(api.polled.wait(), start),
+                        timed(
+                            wait_ready(
+                                f"http://127.0.0.1:{port}/readyz", proc, api.polled
+                            ),
+                            start,
+                        ),
+                    ),
+                    TIMEOUT,
+                )
+                # Stopped at the same point of the polling cycle whichever release it is
+                await asyncio.sleep(start + polled + GRACE - time.perf_counter())
+                stopping = time.perf_counter()
+                proc.send_signal(signal.SIGTERM)
+                await asyncio.wait_for(proc.wait(), TIMEOUT)
+                stop = time.perf_counter() - stopping
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                with open(os.path.join(cwd, "bot.log")) as file:
+                    print(file.read())
+                raise
+    return {"polling": polled, "ready": ready, "stop": stop}
+
+
+def summarise(results: list):
+    """
+    Function to format the runs as a table of the median, fastest and slowest time of each phase.
+
+    Parameters
+    ----------
+    results: list
+        One dictionary of times per run.
+
+    Returns
+    -------
+    str
+        The table, in ms.
+    """
+    lines = [f"{'':10}{'median':>10}{'min':>10}{'max':>10}"]
+    for phase in ("polling", "ready", "stop"):
+        times = [result[phase] for result in results if result[phase] is not None]
+        if not times:
+            lines.append(f"{phase:10}{'-':>10}{'-':>10}{'-':>10}")
+            continue
+        lines.append(
+            f"{phase:10}"
+            + "".join(
+                f"{round(value * 1000):>10}"
+                for value in (statistics.median(times), min(times), max(times))
+            )
+        )
+    return "\n".join(lines)
+
+
+async def main(runs: int, source: str, latency: float):
+    """
+    Starts the fake Bot API and the bot a number of times, printing the times of each phase in ms.
+
+    Parameters
+    ----------
+    runs: int
+        Number of times the bot is started.
+    source: str
+        Directory bot.py is in.
+    latency: float
+        Seconds the fake Bot API adds to every call.
+    """
+    api = FakeBotAPI(latency)
+    await api.start()
+    results = []
+    try:
+        for run in range(runs):
+            results.append(await run_once(api, source))
+            print(
+                f"run {run + 1}: "
+                + ", ".join(
+                    f"{phase} {'-' if value is None else round(value * 1000)} ms"
+                    for phase, value in results[-1].items()
+                )
+            )
+    finally:
+        await api.stop()
+    print(
+        f"\n{source}, {runs} runs, {round(latency * 1000)} ms API latency, "
+        "ms from spawn (stop: from SIGTERM)"
+    )
+    print(summarise(results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="times to start the bot")
+    parser.add_argument(
+        "--source", default=SOURCE, help="directory bot.py is in, to compare releases"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0, help="seconds added to every API call"
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.runs, os.path.abspath(args.source), args.latency))
@@ -0,0 +1,487 @@
+"""
+Benchmark suite which runs offline against local stand-ins for Telegram, MQTT and ICMP. It measures the ping_all
+sweep time by host count, notify throughput by subscriber count, CCTV messages per second, Store write latency
+and startup time, and saves the results as JSON to compare the next release against.
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --compare results.json
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import datetime
+import platform
+import tempfile
+import contextlib
+import statistics
+import subprocess
+
+SOURCE = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.pardir, "telegrambot")
+)
+sys.path.insert(0, SOURCE)
+
+import startup
+from fakes import FakeBotAPI, FakeIcmp, MqttBroker, blueiris_payloads, publish_at
+from telegram import Bot
+from telegram.request import HTTPXRequest
+from cctv import CCTV
+from store import Store
+from probe import Prober
+from digest import AlertDigest
+from sessions import SessionLog
+from scheduler import Scheduler
+from backends import SqliteBackend
+from commands import ping_all
+from utils import Notifier, register_bot, POOL_SIZE
+from metrics import SWEEP_SECONDS, MQTT_MESSAGES
+
+TOKEN = "123:fake"
+THRESHOLD = 0.05  # changes smaller than this share of the baseline are not flagged
+
+
+def percentile(values: list, share: float):
+    """
+    Function to get a percentile by the nearest rank.
+
+    Parameters
+    ----------
+    values: list
+        The values.
+    share: float
+        The percentile between 0 and 1, such as 0.99.
+
+    Returns
+    -------
+    float
+        The value at that rank.
+    """
+    values = sorted(values)
+    return values[round(share * (len(values) - 1))]
+
+
+def empty_store(cwd: str, backend: str = "json", subscribers: int = 0):
+    """
+    Function to create and load a Store in a directory, with a number of subscribers.
+
+    Parameters
+    ----------
+    cwd: str
+        The directory the files are created in.
+    backend: str
+        Either json or sqlite.
+    subscribers: int
+        Number of subscribers, each subscribed to everything.
+
+    Returns
+    -------
+    Store
+        The loaded store.
+    """
+    hosts_file = os.path.join(cwd, "hosts.json")
+    subs_file = os.path.join(cwd, "subscribers.json")
+    subs = {
+        str(100000 + i): {
+            "cctv_sub": True,
+            "status_sub": True,
+            "down_sub": True,
+            "broadcast_sub": True,
+        }
+        for i in range(subscribers)
+    }
+    with open(hosts_file, "w") as file:
+        json.dump({}, file)
+    with open(subs_file, "w") as file:
+        json.dump(subs, file)
+    if backend == "sqlite":
+        store = Store(
+            hosts_file,
+            subs_file,
+            SqliteBackend(os.path.join(cwd, "store.db"), hosts_file, subs_file),
+        )
+    else:
+        store = Store(hosts_file, subs_file)
+    store.load()
+    return store
+
+
+async def bench_sweep(counts: list, icmp: dict, sweeps: int):
+    """
+    Function to time ping_all's sweeps, with every host due on every sweep and echoes answered by FakeIcmp.
+
+    Parameters
+    ----------
+    counts: list
+        Numbers of hosts to time a sweep of.
+    icmp: dict
+        Arguments of FakeIcmp.
+    sweeps: int
+        Number of sweeps averaged for each number of hosts.
+
+    Returns
+    -------
+    dict
+        Mean sweep time in ms by number of hosts.
+    """
+    results = {}
+    for count in counts:
+        with tempfile.TemporaryDirectory() as cwd:
+            store = empty_store(cwd)
+            for i in range(count):
+                store.add_host(
+                    f"host{i}", f"10.{i // 65536}.{i // 256 % 256}.{i % 256}"
+                )
+            await store.flush()
+            prober = Prober(multiplexer=FakeIcmp(**icmp))
+            # Every host is due again as soon as it was pinged
+            scheduler = Scheduler(0, 0, 0, jitter=0)
+            digest = AlertDigest(store, TOKEN)
+            counts_before = list(SWEEP_SECONDS.values.get((), [0, 0]))
+            task = asyncio.create_task(ping_all(store, digest, prober, scheduler))
+            while True:
+                histogram = SWEEP_SECONDS.values.get((), [0, 0])
+                done = sum(histogram[:-1]) - sum(counts_before[:-1])
+                if done >= sweeps or task.done():
+                    break
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            prober.executor.shutdown()
+            seconds = histogram[-1] - counts_before[-1]
+            results[f"sweep.hosts={count}.mean_ms"] = seconds / done * 1000
+    return results
+
+
+async def bench_notify(api, counts: list):
+    """
+    Function to time sending one message to every subscriber through a fresh Notifier and the fake Bot API.
+
+    Parameters
+    ----------
+    api: FakeBotAPI
+        The fake Bot API.
+    counts: list
+        Numbers of subscribers to send to.
+
+    Returns
+    -------
+    dict
+        Messages sent per second and 429s answered by number of subscribers.
+    """
+    results = {}
+    bot = Bot(
+        TOKEN,
+        base_url=f"{api.url}/bot",
+        request=HTTPXRequest(connection_pool_size=POOL_SIZE),
+    )
+    async with bot:
+        for count in counts:
+            api.reset()
+            notifier = Notifier(bot)  # full rate limit buckets for every count
+            chatids = [str(100000 + i) for i in range(count)]
+            start = time.perf_counter()
+            report = await notifier.notify("Benchmark", chatids)
+            elapsed = time.perf_counter() - start
+            results[f"notify.subscribers={count}.msgs_per_s"] = (
+                len(report.sent) / elapsed
+            )
+            results[f"notify.subscribers={count}.throttled_count"] = api.throttled
+    return results
+
+
+async def bench_cctv(api, messages: int, rate: float):
+    """
+    Function to time CCTV.connect consuming BlueIris payloads from the stand-in broker, logging each one.
+
+    Parameters
+    ----------
+    api: FakeBotAPI
+        The fake Bot API logout notifications would be sent through.
+    messages: int
+        Number of payloads published.
+    rate: float
+        Messages published per second, as fast as they are acknowledged if 0.
+
+    Returns
+    -------
+    dict
+        Messages handled per second, and ms from the last publish until it was handled.
+    """
+    broker = MqttBroker()
+    await broker.start()
+    bot = Bot(TOKEN, base_url=f"{api.url}/bot")
+    register_bot(bot)
+    try:
+        with tempfile.TemporaryDirectory() as cwd:
+            store = empty_store(cwd)
+            log = SessionLog(os.path.join(cwd, "cctv.db"))
+            cctv = CCTV("127.0.0.1", "BlueIris/#", "bench", None, log, broker.port)
+            task = asyncio.create_task(cctv.connect(store, TOKEN))
+            await asyncio.wait_for(broker.subscribed.wait(), 10)
+            before = MQTT_MESSAGES.values.get((), 0)
+            start = time.perf_counter()
+            published = await publish_at(
+                broker, "BlueIris/alerts", blueiris_payloads(messages), rate
+            )
+            while MQTT_MESSAGES.values.get((), 0) - before < messages:
+                if task.done():
+                    raise RuntimeError("CCTV consumer stopped")
+                await asyncio.sleep(0.001)
+            elapsed = time.perf_counter() - start
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            log.db.close()
+    finally:
+        await broker.stop()
+    return {
+        "cctv.msgs_per_s": messages / elapsed,
+        "cctv.lag_ms": (elapsed - published) * 1000,
+    }
+
+
+async def bench_store(writes: int, subscribers: int):
+    """
+    Function to time subscription changes on each backend, both the call itself, which runs on the event loop,
+    and until the change is on disk.
+
+    Parameters
+    ----------
+    writes: int
+        Number of changes timed.
+    subscribers: int
+        Number of subscribers in the store.
+
+    Returns
+    -------
+    dict
+        Median and 99th percentile of each latency in ms by backend.
+    """
+    results = {}
+    for backend in ("json", "sqlite"):
+        with tempfile.TemporaryDirectory() as cwd:
+            store = empty_store(cwd, backend, subscribers)
+            calls = []
+            durable = []
+            for i in range(writes):
+                chatid = str(100000 + i % subscribers)
+                start = time.perf_counter()
+                store.update_subscriptions(i % 2 == 0, chatid, "status")
+                calls.append(time.perf_counter() - start)
+                if backend == "json":
+                    # Written by the debounced flush, SQLite commits in the call
+                    await store.backend.flush()
+                durable.append(time.perf_counter() - start)
+            for name, times in (("call", calls), ("durable", durable)):
+                for share in (0.5, 0.99):
+                    key = f"store.{backend}.{name}_p{round(share * 100)}_ms"
+                    results[key] = percentile(times, share) * 1000
+    return results
+
+
+async def bench_startup(runs: int, latency: float):
+    """
+    Function to time the bot starting and stopping as a process, see startup.py.
+
+    Parameters
+    ----------
+    runs: int
+        Number of times the bot is started.
+    latency: float
+        Seconds the fake Bot API adds to every call.
+
+    Returns
+    -------
+    dict
+        Median ms from spawn until polling and until ready, and from SIGTERM until exit.
+    """
+    api = FakeBotAPI(latency)
+    await api.start()
+    try:
+        runs = [await startup.run_once(api, SOURCE) for run in range(runs)]
+    finally:
+        await api.stop()
+    results = {}
+    for phase in ("polling", "ready", "stop"):
+        times = [run[phase] for run in runs if run[phase] is not None]
+        if times:
+            results[f"startup.{phase}_ms"] = statistics.median(times) * 1000
+    return results
+
+
+def better(key: str, change: float):
+    """
+    Function to tell whether a change in a result is an improvement.
+
+    Parameters
+    ----------
+    key: str
+        The result's name, rates end in _per_s and times in _ms.
+    change: float
+        Current value divided by the baseline, minus one.
+
+    Returns
+    -------
+    bool or None
+        True if better, False if worse, None if the result is only informational.
+    """
+    if key.endswith("_per_s"):
+        return change > 0
+    if key.endswith("_ms"):
+        return change < 0
+    return None
+
+
+def report(results: dict, baseline: dict = None):
+    """
+    Function to format the results as a table, with the change from a baseline if one is given.
+
+    Parameters
+    ----------
+    results: dict
+        The results by name.
+    baseline: dict
+        Earlier results by name.
+
+    Returns
+    -------
+    str
+        The table.
+    """
+    width = max(len(key) for key in results)
+    lines = []
+    for key, value in results.items():
+        line = f"{key:{width}}  {value:>10.3f}"
+        if baseline is not None and baseline.get(key):
+            change = value / baseline[key] - 1
+            verdict = better(key, change)
+            flag = ""
+            if verdict is not None and abs(change) >= THRESHOLD:
+                flag = "better" if verdict else "WORSE"
+            line += f"  {baseline[key]:>10.3f}  {change * 100:>+7.1f}%  {flag}"
+        lines.append(line)
+    header = f"{'':{width}}  {'current':>10}"
+    if baseline is not None:
+        header += f"  {'baseline':>10}  {'change':>8}"
+    return "\n".join([header] + lines)
+
+
+def revision():
+    """
+    Function to get the git revision being benchmarked.
+
+    Returns
+    -------
+    str
+        The short commit hash, with -dirty if there are uncommitted changes, unknown outside git.
+    """
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=SOURCE,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def main(args):
+    """
+    Runs every benchmark, prints the report and saves the results.
+
+    Parameters
+    ----------
+    args: Namespace
+        The command line arguments.
+    """
+    api = FakeBotAPI(args.latency, args.throttle, args.retry_after)
+    await api.start()
+    results = {}
+    icmp = {"rtt": args.rtt, "jitter": args.jitter, "loss": args.loss}
+    try:
+        # The bot's own logging would bury the report
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results.update(await bench_sweep(args.hosts, icmp, args.sweeps))
+            results.update(await bench_notify(api, args.subscribers))
+            results.update(await bench_cctv(api, args.messages, args.mqtt_rate))
+            results.update(await bench_store(args.writes, args.store_subscribers))
+            if args.startup_runs:
+                results.update(await bench_startup(args.startup_runs, args.latency))
+    finally:
+        await api.stop()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"Baseline {baseline['revision']} from {baseline['date']}")
+        for key, value in baseline["settings"].items():
+            if vars(args).get(key, value) != value:
+                print(
+                    f"Warning: baseline ran with {key}={value}, not {vars(args)[key]}"
+                )
+    print(f"Revision {revision()}, Python {platform.python_version()}\n")
+    print(report(results, baseline and baseline["results"]))
+    if args.output:
+        settings = dict(vars(args))
+        del settings["output"], settings["compare"]
+        with open(args.output, "w") as file:
+            json.dump(
+                {
+                    "revision": revision(),
+                    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "settings": settings,
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+
+
+def counts(value: str):
+    """
+    Function to parse a comma separated list of counts from the command line.
+
+    Parameters
+    ----------
+    value: str
+        Such as 10,100,1000.
+
+    Returns
+    -------
+    list
+        The counts.
+    """
+    return [int(count) for count in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="file the results are saved to as JSON")
+    parser.add_argument("--compare", help="results saved by an earlier run")
+    parser.add_argument(
+        "--hosts", type=counts, default=[10, 100, 1000], help="host counts to sweep"
+    )
+    parser.add_argument("--sweeps", type=int, default=5, help="sweeps per host count")
+    parser.add_argument("--rtt", type=float, default=0.02, help="echo RTT in seconds")
+    parser.add_argument("--jitter", type=float, default=0.005, help="RTT deviation")
+    parser.add_argument("--loss", type=float, default=0, help="share of echoes lost")
+    parser.add_argument(
+        "--subscribers", type=counts, default=[10, 30, 100], help="chats to notify"
+    )
+    parser.add_argument("--latency", type=float, default=0.05, help="API latency in s")
+    parser.add_argument("--throttle", type=float, default=0, help="share of 429s")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 retry after")
+    parser.add_argument("--messages", type=int, default=2000, help="MQTT messages")
+    parser.add_argument("--mqtt-rate", type=float, default=0, help="0 is unlimited")
+    parser.add_argument("--writes", type=int, default=200, help="store writes timed")
+    parser.add_argument(
+        "--store-subscribers", type=int, default=1000, help="subscribers in the store"
+    )
+    parser.add_argument("--startup-runs", type=int, default=3, help="0 skips startup")
+    asyncio.run(main(parser.parse_args()))
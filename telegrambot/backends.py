@@ -0,0 +1,327 @@
+import os
+import json
+import asyncio
+import sqlite3
+from metrics import STORE_WRITE_SECONDS, Timer
+
+DEBOUNCE = 1.0
+
+
+def atomic_write(path: str, data: str):
+    """
+    Writes a file by writing a temporary file next to it and renaming it into place,
+    so a crash mid-write never leaves a truncated file.
+
+    Parameters
+    ----------
+    path: str
+        The name of the file.
+    data: str
+        The contents to write.
+    """
+    tmp = f"{path}.tmp"
+    with Timer(STORE_WRITE_SECONDS, "json"):
+        with open(tmp, "w") as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp, path)
+
+
+class JsonBackend(object):
+    """
+    JsonBackend class which keeps the hosts and subscribers in two JSON files.
+    Changes made while the event loop is running are batched into one debounced write off the loop.
+    """
+
+    def __init__(self, hosts_file: str, subs_file: str):
+        """
+        Initialises the JsonBackend with the JSON files.
+
+        Parameters
+        ----------
+        hosts_file: str
+            The name of the JSON file containing the hosts.
+        subs_file: str
+            The name of the JSON file containing the subscribers.
+        """
+        self.hosts_file = hosts_file
+        self.subs_file = subs_file
+        self.hosts = {}
+        self.subscribers = {}
+        self.dirty = set()
+        self.timer = None
+        self.tasks = set()
+        self.lock = asyncio.Lock()
+
+    def load(self):
+        """
+        Loads the hosts and subscribers from the JSON files.
+
+        Returns
+        -------
+        tuple
+            The hosts dictionary and the subscribers dictionary.
+        """
+        with open(self.subs_file, "r") as subs_file:
+            self.subscribers = json.load(subs_file)
+        with open(self.hosts_file, "r") as hosts_file:
+            self.hosts = json.load(hosts_file)
+        return self.hosts, self.subscribers
+
+    def snapshot(self, kind: str):
+        """
+        Serialises the hosts or the subscribers as they are now.
+
+        Parameters
+        ----------
+        kind: str
+            Either hosts or subscribers.
+
+        Returns
+        -------
+        tuple
+            The name of the file and its new contents.
+        """
+        if kind == "hosts":
+            return self.hosts_file, json.dumps(self.hosts)
+        return self.subs_file, json.dumps(self.subscribers)
+
+    def schedule(self, kind: str):
+        """
+        Marks the hosts or the subscribers as changed and schedules a debounced flush.
+        Without a running event loop the file is written straight away.
+
+        Parameters
+        ----------
+        kind: str
+            Either hosts or subscribers.
+        """
+        self.dirty.add(kind)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            for kind in self.dirty:
+                atomic_write(*self.snapshot(kind))
+            self.dirty.clear()
+            return
+        if self.timer is None:
+            self.timer = loop.call_later(DEBOUNCE, self.flush_soon)
+
+    def flush_soon(self):
+        """
+        Callback run by the debounce timer to start a flush.
+        """
+        self.timer = None
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush(self):
+        """
+        Writes every changed file atomically in a worker thread.
+        """
+        async with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            dirty, self.dirty = self.dirty, set()
+            for kind in dirty:
+                await asyncio.to_thread(atomic_write, *self.snapshot(kind))
+
+    def put_host(self, host: str, ip: str):
+        """
+        Adds or updates a host.
+
+        Parameters
+        ----------
+        host: str
+            The name of the host.
+        ip: str
+            The IP of the host.
+        """
+        self.hosts[host] = ip
+        self.schedule("hosts")
+
+    def delete_host(self, host: str):
+        """
+        Deletes a host.
+
+        Parameters
+        ----------
+        host: str
+            The name of the host.
+        """
+        self.hosts.pop(host, None)
+        self.schedule("hosts")
+
+    def put_subscriber(self, chatid: str, subs: dict):
+        """
+        Adds or updates a subscriber.
+
+        Parameters
+        ----------
+        chatid: str
+            The chatid of the subscriber.
+        subs: dict
+            The subscriber's subscriptions.
+        """
+        self.subscribers[chatid] = subs
+        self.schedule("subscribers")
+
+    def delete_subscriber(self, chatid: str):
+        """
+        Deletes a subscriber.
+
+        Parameters
+        ----------
+        chatid: str
+            The chatid of the subscriber.
+        """
+        self.subscribers.pop(chatid, None)
+        self.schedule("subscribers")
+
+
+class SqliteBackend(object):
+    """
+    SqliteBackend class which keeps the hosts and subscribers in SQLite (WAL mode) and writes one row per change.
+    The existing JSON files are imported the first time the database is created.
+    """
+
+    def __init__(self, db_file: str, hosts_file: str = None, subs_file: str = None):
+        """
+        Initialises the SqliteBackend, creating the tables if needed.
+
+        Parameters
+        ----------
+        db_file: str
+            The name of the SQLite database file.
+        hosts_file: str
+            The name of the JSON file to migrate the hosts from.
+        subs_file: str
+            The name of the JSON file to migrate the subscribers from.
+        """
+        self.db_file = db_file
+        self.hosts_file = hosts_file
+        self.subs_file = subs_file
+        self.db = sqlite3.connect(db_file)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS hosts (name TEXT PRIMARY KEY, ip TEXT NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS subscribers (chatid TEXT PRIMARY KEY, subs TEXT NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    def migrate(self):
+        """
+        Imports the JSON files into the database, only once.
+        """
+        if self.db.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+            return
+        with self.db:
+            if self.hosts_file and os.path.exists(self.hosts_file):
+                with open(self.hosts_file, "r") as hosts_file:
+                    hosts = json.load(hosts_file)
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO hosts (name, ip) VALUES (?, ?)",
+                    hosts.items(),
+                )
+                print(f"Migrated {len(hosts)} hosts from {self.hosts_file}")
+            if self.subs_file and os.path.exists(self.subs_file):
+                with open(self.subs_file, "r") as subs_file:
+                    subscribers = json.load(subs_file)
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO subscribers (chatid, subs) VALUES (?, ?)",
+                    ((key, json.dumps(value)) for key, value in subscribers.items()),
+                )
+                print(f"Migrated {len(subscribers)} subscribers from {self.subs_file}")
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('migrated', '1')")
+
+    def load(self):
+        """
+        Loads the hosts and subscribers from the database, migrating the JSON files first if needed.
+
+        Returns
+        -------
+        tuple
+            The hosts dictionary and the subscribers dictionary.
+        """
+        self.migrate()
+        hosts = dict(self.db.execute("SELECT name, ip FROM hosts"))
+        subscribers = {
+            chatid: json.loads(subs)
+            for chatid, subs in self.db.execute("SELECT chatid, subs FROM subscribers")
+        }
+        return hosts, subscribers
+
+    async def flush(self):
+        """
+        Checkpoints the write-ahead log into the database, every change is already committed.
+        """
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def put_host(self, host: str, ip: str):
+        """
+        Adds or updates a host.
+
+        Parameters
+        ----------
+        host: str
+            The name of the host.
+        ip: str
+            The IP of the host.
+        """
+        with Timer(STORE_WRITE_SECONDS, "sqlite"), self.db:
+            self.db.execute(
+                "INSERT INTO hosts (name, ip) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET ip = excluded.ip",
+                (host, ip),
+            )
+
+    def delete_host(self, host: str):
+        """
+        Deletes a host.
+
+        Parameters
+        ----------
+        host: str
+            The name of the host.
+        """
+        with Timer(STORE_WRITE_SECONDS, "sqlite"), self.db:
+            self.db.execute("DELETE FROM hosts WHERE name = ?", (host,))
+
+    def put_subscriber(self, chatid: str, subs: dict):
+        """
+        Adds or updates a subscriber.
+
+        Parameters
+        ----------
+        chatid: str
+            The chatid of the subscriber.
+        subs: dict
+            The subscriber's subscriptions.
+        """
+        with Timer(STORE_WRITE_SECONDS, "sqlite"), self.db:
+            self.db.execute(
+                "INSERT INTO subscribers (chatid, subs) VALUES (?, ?) "
+                "ON CONFLICT(chatid) DO UPDATE SET subs = excluded.subs",
+                (chatid, json.dumps(subs)),
+            )
+
+    def delete_subscriber(self, chatid: str):
+        """
+        Deletes a subscriber.
+
+        Parameters
+        ----------
+        chatid: str
+            The chatid of the subscriber.
+        """
+        with Timer(STORE_WRITE_SECONDS, "sqlite"), self.db:
+            self.db.execute("DELETE FROM subscribers WHERE chatid = ?", (chatid,))
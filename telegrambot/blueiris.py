@@ -0,0 +1,59 @@
+import re
+import time
+
+MAX_PAYLOAD = 256
+# "<name> <word> <in|out>", e.g. b"Benji logged in", anything after is ignored
+PAYLOAD = re.compile(rb"\s*(\S{1,64})\s+\S+\s+(in|out)(?:\s.*)?", re.I | re.S)
+
+
+def parse_payload(payload):
+    """
+    Function to parse a BlueIris login payload straight from bytes.
+
+    Parameters
+    ----------
+    payload: bytes
+        The MQTT payload, such as b"Benji logged in".
+
+    Returns
+    -------
+    tuple or None
+        The lower case member name and True for a login or False for a logout, None if the payload is malformed.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    match = None
+    if isinstance(payload, (bytes, bytearray)) and len(payload) <= MAX_PAYLOAD:
+        match = PAYLOAD.fullmatch(payload)
+    if match is None:
+        return None
+    try:
+        name = match.group(1).decode().lower()
+    except UnicodeDecodeError:
+        return None
+    return name, len(match.group(2)) == 2
+
+
+def benchmark(count: int = 100000):
+    """
+    Function to measure how many payloads per second the parser handles.
+
+    Parameters
+    ----------
+    count: int
+        Number of payloads to parse.
+
+    Returns
+    -------
+    float
+        Payloads parsed per second.
+    """
+    payloads = [b"Benji logged in", b"Benji logged out", b"garbage", b""]
+    start = time.perf_counter()
+    for i in range(count):
+        parse_payload(payloads[i % len(payloads)])
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    print(f"{round(benchmark())} payloads/s")
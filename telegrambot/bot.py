@@ -1,11 +1,30 @@
 import os
+import socket
+import secrets
+import signal
 import asyncio
+import inspect
+import importlib
 from functools import partial
 from cctv import CCTV
 from ping import Host
+from probe import Prober
+from cache import ProbeCache
+from scheduler import Scheduler
+from digest import AlertDigest
+from status import Thresholds
+from icmp import IcmpMultiplexer
 from store import Store
+from sessions import SessionLog
+from backends import SqliteBackend
+from outbox import Outbox
+from utils import register_bot, Notifier, POOL_SIZE
 from typing import Final
-from container import start_webhook_server
+from watchdog import Watchdog
+from supervisor import Supervisor
+from github_webhook import GitHubWebhook
+from health import Readiness
+from telegram import Update
 from telegram.ext import Application, CommandHandler
 from commands import (
     start_command,
@@ -14,19 +33,145 @@ from commands import (
     chatid_command,
     ping_command,
     ping_info_command,
+    history_command,
     add_host_command,
     remove_host_command,
     show_hosts_command,
     subscribe_command,
     unsubscribe_command,
     subscribers_command,
+    digest_command,
     cctv_online,
+    cctv_report_command,
+    profile_command,
     error,
     ping_all,
 )
 
 
-def main():
+async def init_step(readiness, name: str, func, *args):
+    """
+    Runs one startup step and marks it ready, blocking functions are run in a thread so the steps overlap.
+
+    Parameters
+    ----------
+    readiness : Readiness
+        The readiness tracker.
+    name : str
+        Name the step is marked ready as.
+    func : callable
+        The step, sync or async.
+    args :
+        Arguments passed to it.
+
+    Returns
+    -------
+    object
+        What the step returned.
+    """
+    if inspect.iscoroutinefunction(func):
+        result = await func(*args)
+    else:
+        result = await asyncio.to_thread(func, *args)
+    readiness.mark(name)
+    return result
+
+
+async def start_app(builder):
+    """
+    Builds the bot application in a thread, as creating its HTTP clients is slow,
+    then initialises it, which checks the token with getMe.
+
+    Parameters
+    ----------
+    builder : ApplicationBuilder
+        The configured application builder.
+
+    Returns
+    -------
+    Application
+        The initialised bot application.
+    """
+    app = await asyncio.to_thread(builder.build)
+    await app.initialize()
+    return app
+
+
+async def serve_http(readiness, *args, **kwargs):
+    """
+    Imports the HTTP server in a thread, aiohttp is slow to import, so polling can start meanwhile,
+    then runs it until cancelled.
+
+    Parameters
+    ----------
+    readiness : Readiness
+        The readiness tracker, served on /readyz.
+    args :
+        Arguments passed to start_webhook_server.
+    kwargs :
+        Keyword arguments passed to start_webhook_server.
+    """
+    container = await init_step(
+        readiness, "aiohttp", importlib.import_module, "container"
+    )
+    await container.start_webhook_server(*args, readiness=readiness, **kwargs)
+
+
+async def start_updates(app, readiness, url: str = None, secret: str = None):
+    """
+    Starts receiving updates, from Telegram pushing them to the webhook server if a URL is given,
+    otherwise by polling for them.
+
+    Parameters
+    ----------
+    app : Application
+        The initialised bot application.
+    readiness : Readiness
+        The readiness tracker, updates are marked ready once they are coming in.
+    url : str
+        Public URL the webhook server is reachable on, /telegram is added to it.
+    secret : str
+        Secret token Telegram sends with every update.
+    """
+    await app.start()
+    if url:
+        await readiness.wait("http")
+        await app.bot.set_webhook(
+            f"{url.rstrip('/')}/telegram",
+            secret_token=secret,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        print("Webhook mode started")
+    else:
+        # message checking for every n number of seconds
+        await app.updater.start_polling(poll_interval=3)
+        print("Polling started")
+    readiness.mark("updates")
+
+
+async def stop_updates(app, supervisor):
+    """
+    Stops receiving updates while the background tasks shut down, then closes the bot application.
+
+    Parameters
+    ----------
+    app : Application
+        The bot application.
+    supervisor : Supervisor
+        Supervisor of the background tasks.
+    """
+    # The updater finishes its poll_interval sleep before stopping, drain meanwhile
+    # so the whole shutdown stays within the supervisor's deadline
+    if app.updater is not None and app.updater.running:
+        await asyncio.gather(app.updater.stop(), supervisor.shutdown())
+    else:
+        await supervisor.shutdown()
+    if app.running:
+        await app.stop()
+    await app.shutdown()
+
+
+async def main():
     # with open("TOKEN.env", "r") as file:
     #     TOKEN = file.read().replace("\n", "")
     # with open("CCTV_SERVER_HOST.env", "r") as file:
@@ -37,14 +182,96 @@ def main():
     TOKEN = os.getenv("TOKEN")
     CCTV_SERVER_HOST = os.getenv("CCTV_SERVER_HOST")
     CCTV_MQTT_TOPIC = os.getenv("CCTV_MQTT_TOPIC")
+    CCTV_MQTT_CLIENT_ID = os.getenv("CCTV_MQTT_CLIENT_ID", "pachamama-telegram-bot")
+    CCTV_MQTT_SHARE_GROUP = os.getenv("CCTV_MQTT_SHARE_GROUP")
+    CCTV_MQTT_PORT = int(os.getenv("CCTV_MQTT_PORT", "1883"))
+    PING_CONCURRENCY = int(os.getenv("PING_CONCURRENCY", "64"))
+    PING_BACKEND = os.getenv("PING_BACKEND", "socket")
+    STORE_BACKEND = os.getenv("STORE_BACKEND", "json")
+    AMBER_MS = os.getenv("AMBER_MS", "120:100")  # enter:exit
+    RED_MS = os.getenv("RED_MS", "200:180")  # enter:exit
+    STATUS_CONFIRM = os.getenv("STATUS_CONFIRM", "3:4")  # N of M sweeps
+    PING_INTERVALS = os.getenv("PING_INTERVALS", "5:10:60")  # down:base:healthy
+    DIGEST_WINDOW = float(os.getenv("DIGEST_WINDOW", "10"))
+    PING_CACHE_TTL = float(os.getenv("PING_CACHE_TTL", "60"))
+    ADMIN_CHATIDS = set(filter(None, os.getenv("ADMIN_CHATIDS", "").split(",")))
+    LOOP_BLOCK_MS = float(os.getenv("LOOP_BLOCK_MS", "250"))
+    TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling")  # polling or webhook
+    TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")  # public URL of HTTP_PORT
+    TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # Bot API server, for benchmarks
+    HTTP_PORT = int(os.getenv("HTTP_PORT", "8989"))  # 0 disables the HTTP server
+    TELEGRAM_WEBHOOK_SECRET = os.getenv(
+        "TELEGRAM_WEBHOOK_SECRET", secrets.token_urlsafe(32)
+    )
+    GITHUB_WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET")
+    DEPLOY_WEBHOOK_TOKEN = os.getenv("DEPLOY_WEBHOOK_TOKEN")
+    SHUTDOWN_DEADLINE = float(os.getenv("SHUTDOWN_DEADLINE", "8"))
+    readiness = Readiness()
+    if TELEGRAM_MODE == "webhook" and not HTTP_PORT:
+        print("HTTP_PORT is 0, falling back to polling")
+        TELEGRAM_MODE = "polling"
+    if TELEGRAM_MODE == "webhook" and not TELEGRAM_WEBHOOK_URL:
+        print("TELEGRAM_WEBHOOK_URL is not set, falling back to polling")
+        TELEGRAM_MODE = "polling"
 
-    cctv = CCTV(CCTV_SERVER_HOST, CCTV_MQTT_TOPIC)
-    store = Store("hosts.json", "subscribers.json")
-    store.load()
+    if CCTV_MQTT_SHARE_GROUP:
+        # Each replica in the group needs its own persistent session
+        CCTV_MQTT_CLIENT_ID = f"{CCTV_MQTT_CLIENT_ID}-{socket.gethostname()}"
+    cctv = CCTV(
+        CCTV_SERVER_HOST,
+        CCTV_MQTT_TOPIC,
+        CCTV_MQTT_CLIENT_ID,
+        CCTV_MQTT_SHARE_GROUP,
+        SessionLog("cctv.db") if CCTV_SERVER_HOST else None,
+        CCTV_MQTT_PORT,
+    )
+    if STORE_BACKEND == "sqlite":
+        backend = SqliteBackend("store.db", "hosts.json", "subscribers.json")
+    else:
+        backend = None
+    amber_enter, amber_exit = map(float, AMBER_MS.split(":"))
+    red_enter, red_exit = map(float, RED_MS.split(":"))
+    confirm, window = map(int, STATUS_CONFIRM.split(":"))
+    thresholds = Thresholds(
+        amber_enter, amber_exit, red_enter, red_exit, confirm, window
+    )
+    store = Store("hosts.json", "subscribers.json", backend, thresholds)
+    multiplexer = IcmpMultiplexer() if PING_BACKEND == "socket" else None
+    prober = Prober(PING_CONCURRENCY, multiplexer=multiplexer)
+    cache = ProbeCache(prober, PING_CACHE_TTL)
+    scheduler = Scheduler(*map(float, PING_INTERVALS.split(":")))
+    watchdog = Watchdog(
+        LOOP_BLOCK_MS / 1000,
+        targets={
+            "ping_all": ping_all,
+            "notify": Notifier.send,
+            "cctv": CCTV.connect,
+        },
+    )
     # print("Store loaded")
     # for store in store.allsubscribers:
     #     print(f"{store}: {store.allsubscribers[store]}")
-    app = Application.builder().token(TOKEN).build()
+    supervisor = Supervisor(SHUTDOWN_DEADLINE)
+    builder = Application.builder().token(TOKEN).connection_pool_size(POOL_SIZE)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL.rstrip('/')}/bot")
+
+    # The store loads while the bot is built and checks its token, anything else
+    # updates do not need, such as the HTTP server, starts once they are coming in
+    jobs = [init_step(readiness, "telegram", start_app, builder)]
+    if TELEGRAM_MODE == "webhook":
+        # Telegram pushes updates to the HTTP server, so it is listening before the webhook is set
+        jobs.append(
+            init_step(readiness, "aiohttp", importlib.import_module, "container")
+        )
+    jobs = [asyncio.create_task(job) for job in jobs]
+    await asyncio.sleep(0)  # let the jobs start their threads before the loop is busy
+    # Loaded on the loop's thread, which the SQLite backend's connection belongs to
+    store.load()
+    readiness.mark("store")
+    app = (await asyncio.gather(*jobs))[0]
+    notifier = register_bot(app.bot)  # notify() reuses the app's HTTP session
+    notifier.outbox = Outbox(notifier, "outbox.db")
     print("Bot started")
 
     # add command handlers
@@ -62,17 +289,24 @@ def main():
     app.add_handler(CommandHandler("chatid", chatid_command))  # ping command
 
     ping_command_partial = partial(
-        ping_command, store
+        ping_command, store, cache
     )  # ping command with hostobj argument
     app.add_handler(CommandHandler("ping", ping_command_partial))  # ping command
 
     ping_info_command_partial = partial(
-        ping_info_command, store
+        ping_info_command, store, prober
     )  # ping info command with hostobj argument
     app.add_handler(
         CommandHandler("pinginfo", ping_info_command_partial)
     )  # ping info command
 
+    history_command_partial = partial(
+        history_command, store
+    )  # history command with hostobj argument
+    app.add_handler(
+        CommandHandler("history", history_command_partial)
+    )  # history command
+
     add_host_command_partial = partial(
         add_host_command, store
     )  # add host command with hostobj argument
@@ -88,7 +322,7 @@ def main():
     )  # remove host command
 
     show_hosts_command_partial = partial(
-        show_hosts_command, store
+        show_hosts_command, store, cache
     )  # show hosts command with hostobj argument
     app.add_handler(
         CommandHandler("showhosts", show_hosts_command_partial)
@@ -113,23 +347,88 @@ def main():
         CommandHandler("unsubscribe", unsubscribe_command_partial)
     )  # remove subscriber
 
+    digest_command_partial = partial(digest_command, store)  # status digest
+    app.add_handler(CommandHandler("digest", digest_command_partial))  # status digest
+
     cctv_online_partial = partial(
         cctv_online, cctv
     )  # cctv online command with cctv argument
     app.add_handler(CommandHandler("cctv", cctv_online_partial))  # cctv online command
 
+    cctv_report_command_partial = partial(
+        cctv_report_command, cctv
+    )  # cctv report command with cctv argument
+    app.add_handler(
+        CommandHandler("cctvreport", cctv_report_command_partial)
+    )  # cctv report command
+
+    profile_command_partial = partial(
+        profile_command, watchdog, ADMIN_CHATIDS
+    )  # profile command with watchdog and admins arguments
+    app.add_handler(
+        CommandHandler("profile", profile_command_partial)
+    )  # profile command
+
     # add error handling
     app.add_error_handler(error)
 
-    loop = asyncio.get_event_loop()
-    loop.create_task(ping_all(store, TOKEN))
-    loop.create_task(cctv.connect(store, TOKEN))
-    loop.create_task(start_webhook_server(store, TOKEN))
+    # Started in this order and stopped in reverse, so producers stop before the outbox drains
+    outbox = notifier.outbox
+    digest = AlertDigest(store, TOKEN, DIGEST_WINDOW)
+    supervisor.add("outbox", outbox.run, outbox.drain)
+    supervisor.add("digest", digest.run, lambda timeout: digest.flush(force=True))
+    if HTTP_PORT:
+        github = GitHubWebhook(
+            store, TOKEN, GITHUB_WEBHOOK_SECRET, DEPLOY_WEBHOOK_TOKEN
+        )
+        supervisor.add(
+            "github",
+            github.run,
+            lambda timeout: asyncio.wait_for(github.queue.join(), timeout),
+        )
+    supervisor.add("ping_all", partial(ping_all, store, digest, prober, scheduler))
+    if CCTV_SERVER_HOST:
+        supervisor.add("cctv", partial(cctv.connect, store, TOKEN))
+        readiness.expect("cctv", lambda: cctv.state == "connected")
+    supervisor.add("watchdog", watchdog.run)
+    if HTTP_PORT:
+        readiness.expect("http")
+        if TELEGRAM_MODE == "webhook":
+            server = partial(
+                serve_http, readiness, github, app, TELEGRAM_WEBHOOK_SECRET
+            )
+        else:
+            server = partial(serve_http, readiness, github)
+        supervisor.add("webhook server", partial(server, port=HTTP_PORT))
+    supervisor.on_shutdown("store", store.flush)
+    supervisor.start()
 
-    # message checking for every n number of seconds
-    print("Polling started")
-    app.run_polling(poll_interval=3)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    readiness.expect("updates")
+    report = asyncio.create_task(readiness.report())
+    if TELEGRAM_MODE == "webhook":
+        starting = start_updates(
+            app, readiness, TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_SECRET
+        )
+    else:
+        starting = start_updates(app, readiness)
+    # A signal while updates are still starting, such as the HTTP port being taken, stops the bot too
+    starting = asyncio.create_task(starting)
+    stopping = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait([starting, stopping], return_when=asyncio.FIRST_COMPLETED)
+        if starting.done():
+            starting.result()  # raises if updates could not be started
+            await stopping
+    finally:
+        starting.cancel()
+        stopping.cancel()
+        report.cancel()
+        await stop_updates(app, supervisor)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
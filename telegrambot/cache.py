@@ -0,0 +1,125 @@
+import time
+import asyncio
+from ping import PingInfo
+
+
+class ProbeCache(object):
+    """
+    ProbeCache class which answers from each host's latest probe while it is fresh,
+    and makes concurrent requests for a stale host share a single probe. Its own probes are
+    kept here, out of the host's history and status, which only the sweep feeds.
+    """
+
+    def __init__(self, prober, ttl: float = 60):
+        """
+        Initialises the ProbeCache.
+
+        Parameters
+        ----------
+        prober: Prober
+            Prober object used when a result is stale.
+        ttl: float
+            Seconds a probe result stays fresh.
+        """
+        self.prober = prober
+        self.ttl = ttl
+        self.inflight = {}
+        # Host name: (PingInfo, monotonic time) of the cache's own probes
+        self.results = {}
+
+    def age(self, host):
+        """
+        Function to get how old a host's latest sweep result is.
+
+        Parameters
+        ----------
+        host: Host
+            The host.
+
+        Returns
+        -------
+        float or None
+            Seconds since the host was last swept, None if it never was.
+        """
+        if host.probed_at is None:
+            return None
+        return time.monotonic() - host.probed_at
+
+    def latest(self, host):
+        """
+        Function to get a host's newest probe result that can still be used, from the sweep or the cache's own.
+
+        Parameters
+        ----------
+        host: Host
+            The host.
+
+        Returns
+        -------
+        tuple or None
+            The PingInfo record and its age in seconds, None if no result is younger than the ttl.
+        """
+        now = time.monotonic()
+        results = []
+        if host.host_name in self.results:
+            results.append(self.results[host.host_name])
+        if host.probed_at is not None:
+            results.append((host.pinginfo, host.probed_at))
+        results = [(info, now - at) for info, at in results if now - at <= self.ttl]
+        return min(results, key=lambda result: result[1]) if results else None
+
+    def fresh(self, host):
+        """
+        Function to check whether a host has a probe result that can still be used.
+
+        Parameters
+        ----------
+        host: Host
+            The host.
+
+        Returns
+        -------
+        bool
+            True if a probe result of the host is younger than the ttl.
+        """
+        return self.latest(host) is not None
+
+    async def refresh(self, host):
+        """
+        Function to probe a host once, keeping the result in the cache.
+
+        Parameters
+        ----------
+        host: Host
+            The host.
+        """
+        ping_times = await self.prober.measure(host, 1)
+        info = PingInfo()
+        info.update(ping_times, 1)
+        self.results[host.host_name] = (info, time.monotonic())
+
+    async def get(self, host):
+        """
+        Function to get a fresh probe result, probing the host once if needed.
+
+        Parameters
+        ----------
+        host: Host
+            The host.
+
+        Returns
+        -------
+        tuple
+            The PingInfo record and its age in seconds.
+        """
+        latest = self.latest(host)
+        if latest is not None:
+            return latest
+        task = self.inflight.get(host.host_name)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self.refresh(host))
+            self.inflight[host.host_name] = task
+            task.add_done_callback(lambda task: self.inflight.pop(host.host_name, None))
+        await asyncio.shield(task)
+        info, probed_at = self.results[host.host_name]
+        return info, time.monotonic() - probed_at
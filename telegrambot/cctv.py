@@ -1,15 +1,55 @@
-import aiomqtt
+import enum
+import time
+import random
+import asyncio
 import datetime
-from utils import notify
+from utils import queue_notify
+from blueiris import parse_payload
+from metrics import MQTT_MESSAGES, MQTT_PARSE_ERRORS
+
+RECONNECT_MIN = 1
+RECONNECT_MAX = 300
+
+
+class Presence(enum.Enum):
+    """
+    Whether a CCTV member is logged in or out.
+    """
+
+    LOGGED_OUT = 0
+    LOGGED_IN = 1
+
+
+def format_time(ts: float):
+    """
+    Function to format a Unix time as HH:MM:SS in local time.
+
+    Parameters
+    ----------
+    ts : float
+        Unix time to format.
+
+    Returns
+    -------
+    str
+        The time in the format HH:MM:SS, an empty string if ts is None.
+    """
+    if ts is None:
+        return ""
+    return time.strftime("%H:%M:%S", time.localtime(ts))
+
 
 class CCTVmember(object):
     """
-    CCTVmember class which stores the name of the member, the time they logged in and out, and whether they are logged in or out.
+    CCTVmember class which stores the name of the member, the Unix times they logged in and out, and whether they are logged in or out.
+    Times are only formatted when they are shown.
     """
 
+    __slots__ = ("name", "presence", "login_ts", "logout_ts")
+
     def __init__(self, name):
         """
-        Initialises the CCTVmember class with the name of the member, and sets the logged in and logged out times to empty strings.
+        Initialises the CCTVmember class with the name of the member, logged out and with no login or logout times.
 
         Parameters
         ----------
@@ -17,48 +57,73 @@ class CCTVmember(object):
             The name of the member.
         """
         self.name = name
-        self.logged_in = False
-        self.logged_in_time = ""
-        self.logged_out = True
-        self.logged_out_time = ""
+        self.presence = Presence.LOGGED_OUT
+        self.login_ts = None
+        self.logout_ts = None
+
+    @property
+    def logged_in(self):
+        """
+        Returns
+        -------
+        bool
+            True if the member is logged in.
+        """
+        return self.presence is Presence.LOGGED_IN
 
-    def get_time(self):
+    @property
+    def logged_out(self):
         """
-        Gets the current time and returns it in the format HH:MM:SS.
+        Returns
+        -------
+        bool
+            True if the member is logged out.
+        """
+        return self.presence is Presence.LOGGED_OUT
 
+    @property
+    def logged_in_time(self):
+        """
         Returns
         -------
-        formatted_time: str
-            The current time in the format HH:MM:SS.
+        str
+            The last login time in the format HH:MM:SS, empty if never logged in.
         """
-        time = datetime.datetime.now()
-        hour = time.hour
-        minute = time.minute
-        second = time.second
-        if hour < 10:
-            hour = f"0{hour}"
-        if minute < 10:
-            minute = f"0{minute}"
-        if second < 10:
-            second = f"0{second}"
-        formatted_time = f"{hour}:{minute}:{second}"
-        return formatted_time
+        return format_time(self.login_ts)
 
-    def login(self):
+    @property
+    def logged_out_time(self):
         """
-        Keeps track of the time the member logged in, and sets the logged in and logged out variables to True and False respectively.
+        Returns
+        -------
+        str
+            The last logout time in the format HH:MM:SS, empty if never logged out.
         """
-        self.logged_in = True
-        self.logged_in_time = self.get_time()
-        self.logged_out = False
+        return format_time(self.logout_ts)
 
-    def logout(self):
+    def login(self, ts: float = None):
         """
-        Keeps track of the time the member logged out, and sets the logged in and logged out variables to False and True respectively.
+        Keeps track of the time the member logged in and marks them as logged in.
+
+        Parameters
+        ----------
+        ts : float
+            Unix time of the login, now if None.
         """
-        self.logged_out = True
-        self.logged_out_time = self.get_time()
-        self.logged_in = False
+        self.presence = Presence.LOGGED_IN
+        self.login_ts = time.time() if ts is None else ts
+
+    def logout(self, ts: float = None):
+        """
+        Keeps track of the time the member logged out and marks them as logged out.
+
+        Parameters
+        ----------
+        ts : float
+            Unix time of the logout, now if None.
+        """
+        self.presence = Presence.LOGGED_OUT
+        self.logout_ts = time.time() if ts is None else ts
 
 
 class CCTV(object):
@@ -66,7 +131,15 @@ class CCTV(object):
     Class which stores the CCTV members and their login and logout times. It also handles the MQTT connection and subscribes to the BlueIris/# topic.
     """
 
-    def __init__(self, server, sub):
+    def __init__(
+        self,
+        server,
+        sub,
+        client_id="pachamama-telegram-bot",
+        share_group=None,
+        log=None,
+        port: int = 1883,
+    ):
         """
         Initialises the CCTV class with the MQTT server and the topic to subscribe to.
 
@@ -76,54 +149,142 @@ class CCTV(object):
             The MQTT server to connect to.
         sub : str
             The topic to subscribe to.
+        client_id : str
+            The MQTT client ID, kept the same across reconnects so the broker holds the session.
+        share_group : str
+            MQTT shared subscription group, replicas in the same group split the topic's messages between them.
+        log : SessionLog
+            Log every login and logout is appended to and the members are restored from, nothing is kept if None.
+        port : int
+            The MQTT server's port.
         """
         self.members = {}
         self.server = server
+        self.port = port
         self.sub = sub
+        self.client_id = client_id
+        self.state = "disconnected"
+        self.reconnects = 0
+        self.backoff = RECONNECT_MIN
+        self.share_group = share_group
+        self.log = log
+        if log is not None:
+            self.restore()
+
+    def restore(self):
+        """
+        Restores every member's latest login and logout from the session log, so a restart keeps who is logged in.
+        """
+        for name, (logged_in, login_ts, logout_ts) in self.log.members().items():
+            member = CCTVmember(name)
+            member.login_ts = login_ts
+            member.logout_ts = logout_ts
+            if logged_in:
+                member.presence = Presence.LOGGED_IN
+            self.members[name] = member
+        if self.members:
+            print(f"CCTV: {len(self.members)} members restored")
 
     async def connect(self, store, TOKEN):
         """
-        Establishes a connection to the MQTT server and subscribes to the topic. It then listens for messages and parses them to get the name of the member and whether they logged in or out.
+        Keeps a connection to the MQTT server, reconnecting with exponential backoff whenever the broker or network drops it.
 
         Parameters
         ----------
-        subscribers : list
-            A list of subscribers to notify when a member logs in or out.
+        store : Store
+            The store object, used to find who to notify when a member logs out.
         TOKEN : str
             The Telegram bot token.
         """
-        async with aiomqtt.Client(self.server) as client:
+        import aiomqtt  # only loaded when CCTV monitoring is enabled
+
+        while True:
+            self.state = "connecting"
+            try:
+                await self.consume(store, TOKEN)
+            except aiomqtt.MqttError as e:
+                print(f"CCTV MQTT connection lost: {e}")
+            except Exception as e:
+                print(f"CCTV consumer crashed: {e}")
+            self.state = "disconnected"
+            self.reconnects += 1
+            delay = self.backoff * random.uniform(0.5, 1)
+            print(f"CCTV reconnecting in {round(delay, 1)}s")
+            await asyncio.sleep(delay)
+            self.backoff = min(self.backoff * 2, RECONNECT_MAX)
+
+    async def consume(self, store, TOKEN):
+        """
+        Establishes a connection to the MQTT server and subscribes to the topic with a persistent session and QoS 1,
+        so messages published while disconnected are delivered on reconnect. It then listens for messages and parses them
+        to get the name of the member and whether they logged in or out.
+
+        Parameters
+        ----------
+        store : Store
+            The store object, used to find who to notify when a member logs out.
+        TOKEN : str
+            The Telegram bot token.
+        """
+        import aiomqtt
+
+        async with aiomqtt.Client(
+            self.server, self.port, client_id=self.client_id, clean_session=False
+        ) as client:
             async with client.messages() as messages:
-                await client.subscribe(self.sub)
+                topic = self.sub
+                if self.share_group:
+                    topic = f"$share/{self.share_group}/{self.sub}"
+                await client.subscribe(topic, qos=1)
+                self.state = "connected"
+                self.backoff = RECONNECT_MIN
+                print(f"CCTV connected to {self.server}")
                 async for message in messages:
-                    print(message.payload)
-                    words = str.split(message.payload.decode())
-                    name = words[0].lower()
-                    log = words[2].lower()
-
-                    if name not in self.members:
-                        self.members[name] = CCTVmember(name)
-
-                    if log == "in":
-                        self.members[name].login()
-                        print(self.members)
-                        print(
-                            f"{self.members[name].name} logged in at {self.members[name].logged_in_time}"
-                        )
-
-                    elif log == "out":
-                        self.members[name].logout()
-                        date = datetime.datetime.now()
-                        formatted_date = date.strftime("%d/%m/%y")
-                        msg = f"""
-                        📸 {self.members[name].name.capitalize()} CCTV Login Time: 
-                        \n[{formatted_date}]        {self.members[name].logged_in_time} - {self.members[name].logged_out_time}
-                        """
-                        print(msg)
-                        cctv_chatids = [
-                            key
-                            for key, value in store.subscribers.items()
-                            if "cctv_sub" in value and value["cctv_sub"]
-                        ]
-
-                        await notify(msg, cctv_chatids, TOKEN)
+                    self.handle(message, store, TOKEN)
+
+    def handle(self, message, store, TOKEN):
+        """
+        Parses one message to get the name of the member and whether they logged in or out,
+        malformed messages are counted and skipped.
+
+        Parameters
+        ----------
+        message : Message
+            The MQTT message.
+        store : Store
+            The store object, used to find who to notify when a member logs out.
+        TOKEN : str
+            The Telegram bot token.
+        """
+        MQTT_MESSAGES.inc()
+        parsed = parse_payload(message.payload)
+        if parsed is None:
+            MQTT_PARSE_ERRORS.inc()
+            print(f"CCTV ignored malformed payload on {message.topic}")
+            return
+        name, login = parsed
+        ts = time.time()
+        if self.log is not None:
+            self.log.append(name, login, ts)
+
+        if name not in self.members:
+            self.members[name] = CCTVmember(name)
+
+        if login:
+            self.members[name].login(ts)
+            print(
+                f"{self.members[name].name} logged in at {self.members[name].logged_in_time}"
+            )
+
+        else:
+            self.members[name].logout(ts)
+            date = datetime.datetime.now()
+            formatted_date = date.strftime("%d/%m/%y")
+            msg = f"""
+            📸 {self.members[name].name.capitalize()} CCTV Login Time: 
+            \n[{formatted_date}]        {self.members[name].logged_in_time} - {self.members[name].logged_out_time}
+            """
+            print(msg)
+            cctv_chatids = store.chatids("cctv_sub")
+
+            queue_notify(msg, cctv_chatids, TOKEN)
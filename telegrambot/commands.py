@@ -1,13 +1,23 @@
 import os
 import sys
 import json
+import time
 import asyncio
 from ping import Host
 from store import Store
+from history import parse_window
+from sessions import format_duration
+from metrics import SWEEP_SECONDS, Timer
 from utils import notify
 from telegram import Update, Bot
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 
+error_codes = {0: "\U0001F7E2", 1: "\U0001F7E1", 2: "\U0001F534", 3: "\u2620"}
+MAX_PING_COUNT = 20
+MAX_PROBES_PER_CHAT = 2
+active_probes = {}
+
 
 # start command function
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -48,16 +58,20 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     \nPlease refer to the below commands to use the bot:
     \n🔥 Popular Commands:
     /cctv - Shows all Online CCTV Members
+    /cctvreport [member] [range] - CCTV shift times and daily totals, e.g. 7d
     /subscribe - Subscribe to the Pachamama Network Status Bot to receive notifications
     /unsubscribe - Unsubscribe from the Pachamama Network Status Bot
     /broadcast <message> - Broadcast a message to all users
+    /digest <minutes> - Get status notifications as a digest, 0 to turn off
     \n🛠️ Debugging Commands:
     /ping <host> - Check the Ping to a Host
     /pinginfo <host> <count> - Check the Ping to a Host with more information
-    /showhosts - Show all Hosts
+    /history <host> [window] - Ping percentiles and loss over a window, e.g. 30m, 6h, 7d
+    /showhosts [status] - Show all Hosts, or their latest status and ping
     /addhost <host> <ip> - Add a Host
     /delhost <host> - Delete a Host
     /chatid - Get the Chat ID
+    /profile [on <seconds>|off] - Admins only, profile the event loop
     /help - Help
     
     """
@@ -81,16 +95,14 @@ async def broadcast_command(
     context : ContextTypes.DEFAULT_TYPE
         Context object from Telegram API
     """
-    broadcast_chatids = [
-        key
-        for key, value in store.subscribers.items()
-        if "broadcast" in value and value["broadcast"]
-    ]
+    broadcast_chatids = store.chatids("broadcast_sub")
 
     if str(update.message.chat_id) in broadcast_chatids:
         msg = " ".join(context.args)
 
-        await notify(msg, broadcast_chatids, TOKEN)
+        report = await notify(msg, broadcast_chatids, TOKEN)
+        if report.failed or report.throttled or report.unreachable:
+            await update.message.reply_text(f"❗️ Broadcast delivery: {report}")
     else:
         await update.message.reply_text(
             f"❌ You are not subscribed to the Pachamama Network Status Bot to send a broadcast message."
@@ -116,27 +128,169 @@ async def error(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+def render_ping_info(host, ping_times: list, count: int):
+    """
+    Function to format the /pinginfo reply from the echoes received so far
+
+    Parameters
+    ----------
+    host : Host
+        Host object being pinged
+    ping_times : list
+        Round trip times so far, None for lost echoes
+    count : int
+        Number of echoes that will be sent
+
+    Returns
+    -------
+    str
+        The reply text
+    """
+    replies = [ping for ping in ping_times if ping is not None]
+    average_ping = round(sum(replies) / len(replies), 2) if replies else 0
+    success_rate = len(replies) / len(ping_times) if ping_times else 0
+    progress = "" if len(ping_times) == count else f" ({len(ping_times)}/{count})"
+    times = ""
+    for ping in ping_times:
+        times += f"\n    {'N/A' if ping is None else round(ping, 2)} ms"
+    return f"""
+    Ping to {host.host_name}: 🏓🏓{progress}
+    Average Ping: {average_ping} ms
+    Ping Count: {len(replies)}
+    Success Rate: {success_rate}
+    
+Ping Times: {times}
+    """
+
+
+async def stream_ping(prober, host, count: int, render, message, chatid: str):
+    """
+    Function to ping a host in the background, editing one message as the echoes arrive,
+    without adding them to the host's history or status
+
+    Parameters
+    ----------
+    prober : Prober
+        Prober object used to send the echoes
+    host : Host
+        Host object to ping
+    count : int
+        Number of echoes to send
+    render : function
+        Function formatting the reply from the echoes so far
+    message : Message
+        Message to edit with the results
+    chatid : str
+        Chat the probe was started from
+    """
+    ping_times = []
+    last_edit = time.monotonic()
+    try:
+        for i in range(count):
+            ping_times.append(await prober.echo(host.ip))
+            # Telegram limits edits, so only update about once a second
+            if i == count - 1 or time.monotonic() - last_edit >= 1:
+                last_edit = time.monotonic()
+                try:
+                    await message.edit_text(render(host, ping_times, count))
+                except TelegramError as e:
+                    print(f"Could not edit ping reply: {e}")
+    finally:
+        active_probes[chatid] -= 1
+
+
+async def start_ping(prober, host, count: int, render, update: Update, context):
+    """
+    Function to start a background ping if the chat is under its limit of running probes
+
+    Parameters
+    ----------
+    prober : Prober
+        Prober object used to send the echoes
+    host : Host
+        Host object to ping
+    count : int
+        Number of echoes to send
+    render : function
+        Function formatting the reply from the echoes so far
+    update : Update
+        Update object from Telegram API
+    context : ContextTypes.DEFAULT_TYPE
+        Context object from Telegram API
+    """
+    chatid = str(update.message.chat_id)
+    if active_probes.get(chatid, 0) >= MAX_PROBES_PER_CHAT:
+        await update.message.reply_text(
+            f"❌ Please wait for your other pings to finish first"
+        )
+        return
+    active_probes[chatid] = active_probes.get(chatid, 0) + 1
+    try:
+        message = await update.message.reply_text(f"Pinging {host.host_name}... 🏓")
+    except Exception:
+        active_probes[chatid] -= 1
+        raise
+    context.application.create_task(
+        stream_ping(prober, host, count, render, message, chatid)
+    )
+
+
+async def reply_cached_ping(cache, host, message):
+    """
+    Function to edit a reply with a host's ping once a fresh result is available
+
+    Parameters
+    ----------
+    cache : ProbeCache
+        ProbeCache object holding the latest probe results
+    host : Host
+        Host object to ping
+    message : Message
+        Message to edit with the result
+    """
+    pinginfo, age = await cache.get(host)
+    try:
+        await message.edit_text(
+            f"Ping to {host.host_name}: 🏓\n{round(pinginfo.average_ping, 2)} ms"
+        )
+    except TelegramError as e:
+        print(f"Could not edit ping reply: {e}")
+
+
 # ping command function
-async def ping_command(store, update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def ping_command(
+    store, cache, update: Update, context: ContextTypes.DEFAULT_TYPE
+):
     """
-    Command for user if they want to ping a host
+    Command for user if they want to ping a host, answered from the latest background probe when it is fresh
 
     Parameters
     ----------
     store : Store
         Store object from Store class
+    cache : ProbeCache
+        ProbeCache object holding the latest probe results
     update : Update
         Update object from Telegram API
     context : ContextTypes.DEFAULT_TYPE
         Context object from Telegram API
     """
     host = store.hostobj[context.args[0].lower().capitalize()]
-    host.ping(1)
-    ping = host.pinginfo["average_ping"]
-    await update.message.reply_text(f"Ping to {host.host_name}: 🏓\n{ping} ms")
+    latest = cache.latest(host)
+    if latest is not None:
+        pinginfo, age = latest
+        await update.message.reply_text(
+            f"Ping to {host.host_name}: 🏓\n{round(pinginfo.average_ping, 2)} ms"
+            f"\n(measured {round(age)}s ago)"
+        )
+        return
+    message = await update.message.reply_text(f"Pinging {host.host_name}... 🏓")
+    context.application.create_task(reply_cached_ping(cache, host, message))
 
 
-async def ping_info_command(store, update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def ping_info_command(
+    store, prober, update: Update, context: ContextTypes.DEFAULT_TYPE
+):
     """
     Command for user if they want to ping a host with more information
 
@@ -144,6 +298,8 @@ async def ping_info_command(store, update: Update, context: ContextTypes.DEFAULT
     ----------
     store : Store
         Store object from Store class
+    prober : Prober
+        Prober object used to send the echoes
     update : Update
         Update object from Telegram API
     context : ContextTypes.DEFAULT_TYPE
@@ -151,22 +307,80 @@ async def ping_info_command(store, update: Update, context: ContextTypes.DEFAULT
     """
     host = store.hostobj[context.args[0].lower().capitalize()]
     count = int(context.args[1])
-    host.ping(count)
-    ping_times = ""
-    for ping in host.pinginfo["ping_times"]:
-        ping_times += f"\n    {ping} ms"
+    if not 0 < count <= MAX_PING_COUNT:
+        await update.message.reply_text(
+            f"❌ Ping count must be between 1 and {MAX_PING_COUNT}"
+        )
+        return
+    await start_ping(prober, host, count, render_ping_info, update, context)
+
+
+async def history_command(store, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Command for user if they want to see the ping history of a host
+
+    Parameters
+    ----------
+    store : Store
+        Store object from Store class
+    update : Update
+        Update object from Telegram API
+    context : ContextTypes.DEFAULT_TYPE
+        Context object from Telegram API
+    """
+    host = store.hostobj[context.args[0].lower().capitalize()]
+    window = context.args[1] if len(context.args) > 1 else "1h"
+    stats = host.history.query(parse_window(window))
+    if stats["samples"] == 0:
+        await update.message.reply_text(
+            f"❌ No pings to {host.host_name} in the last {window}"
+        )
+        return
+    percentiles = ""
+    for pct in ("p50", "p95", "p99"):
+        value = stats[pct]
+        percentiles += f"\n    {pct}: {'N/A' if value is None else round(value, 2)} ms"
     await update.message.reply_text(
         f"""
-    Ping to {host.host_name}: 🏓🏓
-    Average Ping: {host.pinginfo['average_ping']} ms
-    Ping Count: {host.pinginfo['ping_count']}
-    Success Rate: {host.pinginfo['success_rate']}
-    
-Ping Times: {ping_times}
+    Ping history to {host.host_name} over {window}: 📈
+    Pings: {stats['samples']}
+    Loss: {round(stats['loss'] * 100, 1)}%
+    {percentiles}
     """
     )
 
 
+async def digest_command(store, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Command for user if they want their status notifications batched into a digest
+
+    Parameters
+    ----------
+    store : Store
+        Store object from Store class
+    update : Update
+        Update object from Telegram API
+    context : ContextTypes.DEFAULT_TYPE
+        Context object from Telegram API
+    """
+    chatid = str(update.message.chat_id)
+    if chatid not in store.subscribers:
+        await update.message.reply_text(
+            f"❌ You are not subscribed to the Pachamama Network Status Bot"
+        )
+        return
+    minutes = int(context.args[0]) if context.args else 0
+    store.set_digest(chatid, minutes)
+    if minutes > 0:
+        await update.message.reply_text(
+            f"📋 Status notifications will be sent as a digest every {minutes} minutes"
+        )
+    else:
+        await update.message.reply_text(
+            f"📋 Status notifications will be sent as they happen"
+        )
+
+
 # add host command function
 async def add_host_command(store, update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -215,19 +429,36 @@ async def remove_host_command(
 
 
 # show hosts command function
-async def show_hosts_command(store, update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def show_hosts_command(
+    store, cache, update: Update, context: ContextTypes.DEFAULT_TYPE
+):
     """
-    Command for user if they want to see all hosts
+    Command for user if they want to see all hosts, or with 'status' every host's latest status and ping
 
     Parameters
     ----------
     store : Store
         Store object from Store class
+    cache : ProbeCache
+        ProbeCache object holding the latest probe results
     update : Update
         Update object from Telegram API
     context : ContextTypes.DEFAULT_TYPE
         Context object from Telegram API
     """
+    if context.args and context.args[0].lower() == "status":
+        hosts_string = "Host - Status - Ping\n"
+        for name, host in store.hostobj.items():
+            age = cache.age(host)
+            if age is None:
+                hosts_string += f"{(host.host_name).capitalize()} - ❔ not pinged yet\n"
+                continue
+            hosts_string += (
+                f"{(host.host_name).capitalize()} - {error_codes[host.status.state]}"
+                f" - {round(host.pinginfo.average_ping, 2)} ms ({round(age)}s ago)\n"
+            )
+        await update.message.reply_text(hosts_string)
+        return
     hosts_string = "Host - IP\n"
     for name, host in store.hostobj.items():
         hosts_string += f"{(host.host_name).capitalize()} - {host.ip}\n"
@@ -282,6 +513,8 @@ async def subscribe_command(store, update: Update, context: ContextTypes.DEFAULT
         store.update_subscriptions(True, chatid, arguments)
         listofsubs = f"\n"
         for key, value in store.subscribers[chatid].items():
+            if not isinstance(value, bool):
+                continue
             if value == True:
                 listofsubs += f"✅{key}\n"
             else:
@@ -339,6 +572,8 @@ async def unsubscribe_command(
         store.update_subscriptions(False, chatid, arguments)
         listofsubs = f"\n"
         for key, value in store.subscribers[chatid].items():
+            if not isinstance(value, bool):
+                continue
             if value == True:
                 listofsubs += f"✅{key}\n"
             else:
@@ -386,6 +621,10 @@ async def cctv_online(cctv, update: Update, context: ContextTypes.DEFAULT_TYPE):
         Context object from Telegram API
     """
     all_online = f"📹 Online CCTV Users:\n"
+    if cctv.server and cctv.state != "connected":
+        all_online = (
+            f"⚠️ CCTV server {cctv.state}, {cctv.reconnects} reconnects\n" + all_online
+        )
     for key, value in cctv.members.items():
         if value.logged_in == True:
             all_online += f"{value.name.capitalize()} - {value.logged_in_time}\n"
@@ -393,59 +632,139 @@ async def cctv_online(cctv, update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(all_online)
 
 
-async def ping_all(store, TOKEN):
+async def cctv_report_command(cctv, update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Function to ping all hosts and send notifications to subscribers
+    Command for user if they want to see CCTV shift durations and daily totals over a range
+
+    Parameters
+    ----------
+    cctv : CCTV
+        CCTV object whose session log is read
+    update : Update
+        Update object from Telegram API
+    context : ContextTypes.DEFAULT_TYPE
+        Context object from Telegram API
+    """
+    if cctv.log is None:
+        await update.message.reply_text("❌ CCTV sessions are not being logged")
+        return
+    name = None
+    window = "7d"
+    for arg in context.args:
+        try:
+            parse_window(arg)
+            window = arg
+        except ValueError:
+            name = arg.lower()
+    end = time.time()
+    start = end - parse_window(window)
+    totals = cctv.log.totals(start, end, name)
+    if not totals:
+        await update.message.reply_text(f"❌ No CCTV sessions in the last {window}")
+        return
+    report = f"📹 CCTV report over {window}:\n"
+    for member, days in totals.items():
+        report += (
+            f"\n{member.capitalize()} - {format_duration(sum(days.values()))} total\n"
+        )
+        for day, seconds in sorted(days.items()):
+            report += f"    {day.strftime('%d/%m/%y')}: {format_duration(seconds)}\n"
+    if name is not None:
+        report += "\nShifts:\n"
+        for member, begin, finish, ongoing in cctv.log.shifts(start, end, name):
+            since = time.strftime("%d/%m/%y %H:%M", time.localtime(begin))
+            until = "now" if ongoing else time.strftime("%H:%M", time.localtime(finish))
+            report += f"    {since} - {until} ({format_duration(finish - begin)})\n"
+    await update.message.reply_text(report)
+
+
+async def profile_command(
+    watchdog, admins, update: Update, context: ContextTypes.DEFAULT_TYPE
+):
+    """
+    Command for admins to sample where the event loop spends its time, and see the result
+
+    Parameters
+    ----------
+    watchdog : Watchdog
+        Watchdog object which samples the event loop
+    admins : set
+        Chat IDs allowed to profile the bot
+    update : Update
+        Update object from Telegram API
+    context : ContextTypes.DEFAULT_TYPE
+        Context object from Telegram API
+    """
+    if str(update.message.chat_id) not in admins:
+        await update.message.reply_text("❌ Only admins can profile the bot.")
+        return
+    action = context.args[0].lower() if context.args else ""
+    if action == "on":
+        seconds = float(context.args[1]) if len(context.args) > 1 else 60
+        watchdog.start_profiling(seconds)
+        await update.message.reply_text(
+            f"🔬 Profiling the event loop for {seconds}s, send /profile to see the result"
+        )
+        return
+    if action == "off":
+        watchdog.stop_profiling()
+    state = "running" if watchdog.profiling() else "stopped"
+    await update.message.reply_text(f"🔬 Profile ({state}):\n{watchdog.report()}")
+
+
+async def ping_all(store, digest, prober, scheduler):
+    """
+    Function to ping each host when the scheduler says it is due and send notifications to subscribers
 
     Parameters
     ----------
     store : Store
         Store object from Store class
-    subscribers : dict
-        Dictionary of subscribers
-    TOKEN : str
-        Telegram bot token
+    digest : AlertDigest
+        AlertDigest object which combines changes into one message per chat
+    prober : Prober
+        Prober object which pings every host concurrently
+    scheduler : Scheduler
+        Scheduler object which decides when each host is next pinged
     """
-    error_codes = {0: "\U0001F7E2", 1: "\U0001F7E1", 2: "\U0001F534", 3: "\u2620"}
     while True:
-        print("pinging")
-        for key, single_hostobj in store.hostobj.items():
-            single_hostobj.ping(4)
-            status = single_hostobj.pinginfo["status"]
-            average_ping = single_hostobj.pinginfo["average_ping"]
+        scheduler.sync(store.hostobj)
+        due = [store.hostobj[name] for name in scheduler.pop_due()]
+        swept = []
+        if due:
+            with Timer(SWEEP_SECONDS):
+                swept = await prober.sweep(due, 4)
+        for single_hostobj in swept:
+            try:
+                error_code = single_hostobj.evaluate()
+            finally:
+                # Rescheduled from the new status, so a first failed probe is soon checked again
+                scheduler.reschedule(single_hostobj)
+            status = single_hostobj.pinginfo.status
+            average_ping = single_hostobj.pinginfo.average_ping
             if status == False:
-                print(
-                    f"{single_hostobj.host_name}: network down"
-                    and single_hostobj.down_notify_flag == False
-                )
-                error_code = single_hostobj.down()
-            elif status == True and (120 < average_ping < 200):
-                error_code = single_hostobj.amber()
-            elif status == True and (average_ping >= 200):
-                error_code = single_hostobj.red()
-            elif status == True and (average_ping <= 120):
-                error_code = single_hostobj.green()
-            else:
-                pass
-            down_chatids = [
-                key
-                for key, value in store.subscribers.items()
-                if "down_sub" in value and value["down_sub"]
-            ]
-            status_chatids = [
-                key
-                for key, value in store.subscribers.items()
-                if "status_sub" in value and value["status_sub"]
-            ]
+                print(f"{single_hostobj.host_name}: network down")
+            down_chatids = store.chatids("down_sub")
+            status_chatids = store.chatids("status_sub")
             if error_code == 3:
                 msg = f"""🚨 {single_hostobj.host_name} is down!
                         \nContact Benji to fix the network asap!
                         \n(https://t.me/owen97779)"""
-                await notify(msg, down_chatids, TOKEN)
+                line = f"🚨 {single_hostobj.host_name} is down!"
+                digest.add("down", down_chatids, single_hostobj.host_name, msg, line)
             if error_code != -1 and error_code != 3:
                 msg = f"""⚠️ {single_hostobj.host_name}:
                 Online: {status}
                 Internet Speed: {error_codes[error_code]}
                 Average ping: {str(round(average_ping, 2)) + "ms"}"""
-                await notify(msg, status_chatids, TOKEN)
-        await asyncio.sleep(10)
+                line = (
+                    f"{error_codes[error_code]} {single_hostobj.host_name}: "
+                    f"{round(average_ping, 2)}ms"
+                )
+                digest.add(
+                    "status", status_chatids, single_hostobj.host_name, msg, line
+                )
+        next_due = scheduler.next_due()
+        # Wake at least every second so newly added hosts are picked up
+        wait = 1 if next_due is None else next_due - time.monotonic()
+        await asyncio.sleep(min(max(wait, 0), 1))
@@ -1,81 +1,124 @@
+import hmac
+import json
 import asyncio
-from utils import notify
 from aiohttp import web
+from telegram import Update
+from metrics import render
 from functools import partial
 
 
-async def webhook_handler(store, TOKEN, request):
+async def telegram_handler(app, secret, request):
     """
-    webhook_handler function to handle webhook requests from GitHub.
+    telegram_handler function to hand Telegram updates pushed to the webhook to the bot application.
 
     Parameters
     ----------
-    store: Store
-        The store object.
-    TOKEN: Final
-        The bot token.
+    app: Application
+        The bot application.
+    secret: str
+        The secret token Telegram sends with every update.
     request: Request
         The request object.
+    """
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token.encode(), secret.encode()):
+        return web.Response(status=403, text="Invalid secret token")
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400, text="Invalid JSON")
+    if not isinstance(data, dict):
+        return web.Response(status=400, text="Update is not a JSON object")
+    try:
+        update = Update.de_json(data, app.bot)
+    except (KeyError, TypeError, ValueError):
+        return web.Response(status=400, text="Invalid update")
+    await app.update_queue.put(update)
+    return web.Response(text="OK")
+
+
+async def metrics_handler(request):
+    """
+    metrics_handler function to serve the bot's metrics in the Prometheus text format.
+
+    Parameters
+    ----------
+    request: Request
+        The request object.
+    """
+    return web.Response(text=render(), content_type="text/plain")
+
+
+async def health_handler(request):
+    """
+    health_handler function to report that the process is up and serving.
+
+    Parameters
+    ----------
+    request: Request
+        The request object.
+    """
+    return web.Response(text="OK")
+
+
+async def ready_handler(readiness, request):
+    """
+    ready_handler function to report whether every subsystem has started, 503 until they have.
 
+    Parameters
+    ----------
+    readiness: Readiness
+        The readiness tracker.
+    request: Request
+        The request object.
     """
-    data = await request.post()
-    event_type = request.headers.get("X-GitHub-Event")
-    broadcast_chatids = [
-        key
-        for key, value in store.subscribers.items()
-        if "broadcast_sub" in value and value["broadcast_sub"]
-    ]
-    if event_type == "push":
-        pass
-        
-    #     # Process the push event payload
-    #     branch = data.get('ref')
-    #     commits = data.get('commits')
-    #     print(f"Push event received for branch {branch}")
-    #     print("Commits:")
-    #     for commit in commits:
-    #         print(commit.get('message'))
-
-    #     # Add your webhook handling logic here
-
-    # elif event_type == 'pull_request':
-    #     # Process the pull request event payload
-    #     action = data.get('action')
-    #     pr_number = data.get('number')
-    #     print(f"Pull request event received - action: {action}, PR number: {pr_number}")
-
-    #     # Add your webhook handling logic here
-
-    else:
-        print("Unsupported event type")
-    
-    msg = f"""❕ The bot has received a new update, it will now restart!\n
-        Please resubscribe to receive new notifications.
-        Contact Benji if you require any assistance.
-        (https://t.me/owen97779)"""
-    print("RESTART MESSAGE SENT")
-    await notify(msg, broadcast_chatids, TOKEN)
-
-    return web.Response(text="Webhook processed successfully")
-
-
-async def start_webhook_server(store, TOKEN):
+    status = readiness.status()
+    return web.Response(
+        status=200 if all(status.values()) else 503,
+        text=json.dumps(status),
+        content_type="application/json",
+    )
+
+
+async def start_webhook_server(
+    github, app=None, secret=None, readiness=None, port: int = 8989
+):
     """
-    start_webhook_server function to start the webhook server.
+    start_webhook_server function to run the webhook server until cancelled, then clean it up.
 
     Parameters
     ----------
-    store: Store
-        The store object.
-    TOKEN: Final
-        The bot token.
+    github: GitHubWebhook
+        The GitHub webhook, served on /webhook.
+    app: Application
+        The bot application, Telegram updates are accepted on /telegram if given.
+    secret: str
+        The secret token Telegram updates must carry.
+    readiness: Readiness
+        The readiness tracker, served on /readyz and marked once the server is up if given.
+    port: int
+        The port to listen on.
     """
-    app = web.Application()
-    webhook_handler_partial = partial(webhook_handler, store, TOKEN)
-    app.router.add_post("/webhook", webhook_handler_partial)
+    server = web.Application()
+    server.router.add_post("/webhook", github.handle)
+    server.router.add_get("/metrics", metrics_handler)
+    server.router.add_get("/healthz", health_handler)
+    if readiness is not None:
+        server.router.add_get("/readyz", partial(ready_handler, readiness))
+    if app is not None:
+        telegram_handler_partial = partial(telegram_handler, app, secret)
+        server.router.add_post("/telegram", telegram_handler_partial)
 
-    runner = web.AppRunner(app)
+    runner = web.AppRunner(server)
     await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", 8989)
+    site = web.TCPSite(runner, "0.0.0.0", port)
     await site.start()
-    print("Webhook server started on http://localhost:8989")
+    if readiness is not None:
+        readiness.mark("http")
+    routes = ", ".join(resource.canonical for resource in server.router.resources())
+    print(f"Webhook server started on http://localhost:{port} ({routes})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        print("Webhook server stopped")
@@ -0,0 +1,96 @@
+import time
+import asyncio
+from utils import queue_notify
+
+
+class AlertDigest(object):
+    """
+    AlertDigest class which gathers host state changes for a short window and sends each chat one message,
+    so an outage across many hosts costs one message per subscriber instead of one per host.
+    Subscribers with a status digest schedule get their status changes batched over that many minutes.
+    """
+
+    def __init__(self, store, TOKEN, window: float = 10):
+        """
+        Initialises an empty AlertDigest.
+
+        Parameters
+        ----------
+        store: Store
+            The store object, read for each subscriber's digest schedule.
+        TOKEN: Final
+            The bot token.
+        window: float
+            Seconds to gather changes for before sending.
+        """
+        self.store = store
+        self.TOKEN = TOKEN
+        self.window = window
+        self.buffers = {}
+
+    def add(self, kind: str, chatids, host_name: str, msg: str, line: str):
+        """
+        Adds a state change for some chats.
+
+        Parameters
+        ----------
+        kind: str
+            Either down or status.
+        chatids: set
+            The chat IDs to tell.
+        host_name: str
+            Name of the host, only its latest change is kept.
+        msg: str
+            Message to send if this is the only change for a chat.
+        line: str
+            One line summary used when changes are combined.
+        """
+        now = time.monotonic()
+        for chatid in chatids:
+            delay = self.window
+            if kind == "status":
+                subs = self.store.subscribers.get(chatid, {})
+                delay = max(delay, subs.get("status_digest", 0) * 60)
+            buffer = self.buffers.setdefault(
+                chatid, {"due": now + delay, "changes": {}}
+            )
+            # A down alert pulls forward any status digest already waiting
+            buffer["due"] = min(buffer["due"], now + delay)
+            buffer["changes"][host_name] = (msg, line)
+
+    def flush(self, now: float = None, force: bool = False):
+        """
+        Sends every buffer that is due, chats getting the same text share one queued notification.
+
+        Parameters
+        ----------
+        now: float
+            Monotonic time now, now if None.
+        force: bool
+            Send every buffer, due or not.
+        """
+        if now is None:
+            now = time.monotonic()
+        messages = {}
+        for chatid, buffer in list(self.buffers.items()):
+            if not force and buffer["due"] > now:
+                continue
+            del self.buffers[chatid]
+            changes = list(buffer["changes"].values())
+            if len(changes) == 1:
+                msg = changes[0][0]
+            else:
+                msg = f"📋 {len(changes)} network changes:\n" + "\n".join(
+                    line for msg, line in changes
+                )
+            messages.setdefault(msg, []).append(chatid)
+        for msg, chatids in messages.items():
+            queue_notify(msg, chatids, self.TOKEN)
+
+    async def run(self):
+        """
+        Sends buffers as they become due until cancelled.
+        """
+        while True:
+            await asyncio.sleep(1)
+            self.flush()
@@ -0,0 +1,262 @@
+import hmac
+import json
+import time
+import asyncio
+import hashlib
+from urllib.parse import parse_qs
+from utils import queue_notify
+
+MAX_BODY = 5 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+QUEUE_SIZE = 100
+DELIVERY_TTL = 3600  # seconds a delivery ID is remembered for
+DEPLOY_COOLDOWN = 300  # seconds between restart broadcasts
+
+
+class GitHubWebhook(object):
+    """
+    GitHubWebhook class which verifies GitHub webhook deliveries, answers them straight away and processes them
+    in the background, one handler per event type. Requests without an event header come from the CI deploy step
+    and announce a restart. Every request must be signed with the secret or carry the deploy token, whatever its
+    headers, so nothing is accepted if neither is configured.
+    """
+
+    def __init__(self, store, TOKEN, secret: str = None, deploy_token: str = None):
+        """
+        Initialises the GitHubWebhook.
+
+        Parameters
+        ----------
+        store: Store
+            The store object, used to find who to tell about a restart.
+        TOKEN: Final
+            The bot token.
+        secret: str
+            Secret GitHub signs deliveries with, signed requests are not accepted if None.
+        deploy_token: str
+            Token the deploy step passes as ?token=, requests with a token are not accepted if None.
+        """
+        self.store = store
+        self.TOKEN = TOKEN
+        self.secret = secret or None
+        self.deploy_token = deploy_token or None
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.deliveries = {}
+        self.last_deploy = None
+        self.handlers = {
+            "push": self.on_push,
+            "pull_request": self.on_pull_request,
+            "ping": self.on_ping,
+            None: self.on_deploy,
+        }
+        if not secret and not deploy_token:
+            print(
+                "WARNING: neither GITHUB_WEBHOOK_SECRET nor DEPLOY_WEBHOOK_TOKEN is set, "
+                "every request to /webhook will be refused"
+            )
+
+    async def read_body(self, request):
+        """
+        Function to read the request body in chunks up to MAX_BODY, working out its signature as it arrives.
+
+        Parameters
+        ----------
+        request: Request
+            The request object.
+
+        Returns
+        -------
+        tuple
+            The body and its sha256= signature, None if there is no secret.
+        """
+        from aiohttp import web  # only loaded once the HTTP server starts
+
+        if (request.content_length or 0) > MAX_BODY:
+            raise web.HTTPRequestEntityTooLarge(
+                max_size=MAX_BODY, actual_size=request.content_length
+            )
+        digest = (
+            hmac.new(self.secret.encode(), digestmod=hashlib.sha256)
+            if self.secret
+            else None
+        )
+        body = bytearray()
+        async for chunk in request.content.iter_chunked(CHUNK_SIZE):
+            body += chunk
+            if len(body) > MAX_BODY:
+                raise web.HTTPRequestEntityTooLarge(
+                    max_size=MAX_BODY, actual_size=len(body)
+                )
+            if digest is not None:
+                digest.update(chunk)
+        signature = f"sha256={digest.hexdigest()}" if digest is not None else None
+        return bytes(body), signature
+
+    def parse(self, request, body: bytes):
+        """
+        Function to decode a delivery's payload, sent either as JSON or as a form with a payload field.
+
+        Parameters
+        ----------
+        request: Request
+            The request object.
+        body: bytes
+            The request body.
+
+        Returns
+        -------
+        dict
+            The payload, empty if there is no body.
+        """
+        if not body.strip():
+            return {}
+        if request.content_type == "application/x-www-form-urlencoded":
+            body = parse_qs(body.decode()).get("payload", ["{}"])[0]
+        payload = json.loads(body)
+        if not isinstance(payload, dict):
+            raise ValueError("payload is not a JSON object")
+        return payload
+
+    def seen(self, delivery: str):
+        """
+        Function to check whether a delivery was already queued, remembering it if not.
+
+        Parameters
+        ----------
+        delivery: str
+            The X-GitHub-Delivery ID.
+
+        Returns
+        -------
+        bool
+            True if the delivery is a duplicate.
+        """
+        now = time.monotonic()
+        for old, when in list(self.deliveries.items()):
+            if now - when < DELIVERY_TTL:
+                break
+            del self.deliveries[old]
+        if delivery in self.deliveries:
+            return True
+        self.deliveries[delivery] = now
+        return False
+
+    async def handle(self, request):
+        """
+        handle function to verify a delivery, queue it and answer 202 without waiting for it to be processed.
+
+        Parameters
+        ----------
+        request: Request
+            The request object.
+        """
+        from aiohttp import web
+
+        if self.secret is None and self.deploy_token is None:
+            return web.Response(status=403, text="Webhook not configured")
+        event = request.headers.get("X-GitHub-Event")
+        token = request.query.get("token")
+        verified = (
+            self.deploy_token is not None
+            and token is not None
+            and hmac.compare_digest(token.encode(), self.deploy_token.encode())
+        )
+        body, signature = await self.read_body(request)
+        if not verified and signature is not None:
+            received = request.headers.get("X-Hub-Signature-256", "")
+            verified = hmac.compare_digest(received.encode(), signature.encode())
+        if not verified:
+            return web.Response(status=401, text="Invalid signature or token")
+        try:
+            payload = self.parse(request, body)
+        except ValueError:
+            return web.Response(status=400, text="Invalid JSON")
+        delivery = request.headers.get("X-GitHub-Delivery")
+        if delivery is not None and self.seen(delivery):
+            return web.Response(status=202, text="Duplicate delivery")
+        try:
+            self.queue.put_nowait((event, delivery, payload))
+        except asyncio.QueueFull:
+            self.deliveries.pop(delivery, None)
+            return web.Response(status=503, text="Busy, try again later")
+        return web.Response(status=202, text="Webhook queued")
+
+    async def run(self):
+        """
+        Processes queued deliveries one at a time until cancelled.
+        """
+        while True:
+            event, delivery, payload = await self.queue.get()
+            handler = self.handlers.get(event)
+            try:
+                if handler is None:
+                    print(f"Unsupported event type {event} ({delivery})")
+                else:
+                    await handler(payload)
+            except Exception as e:
+                print(f"Webhook {event} ({delivery}) failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def on_push(self, payload: dict):
+        """
+        Handles a push event.
+
+        Parameters
+        ----------
+        payload: dict
+            The event payload.
+        """
+        commits = payload.get("commits") or []
+        print(
+            f"Push event received for branch {payload.get('ref')}, {len(commits)} commits"
+        )
+        for commit in commits:
+            message = commit.get("message") or ""
+            print(f"    {message.partition(chr(10))[0]}")
+
+    async def on_pull_request(self, payload: dict):
+        """
+        Handles a pull request event.
+
+        Parameters
+        ----------
+        payload: dict
+            The event payload.
+        """
+        print(
+            f"Pull request event received - action: {payload.get('action')},"
+            f" PR number: {payload.get('number')}"
+        )
+
+    async def on_ping(self, payload: dict):
+        """
+        Handles the ping GitHub sends when the webhook is created.
+
+        Parameters
+        ----------
+        payload: dict
+            The event payload.
+        """
+        print(f"GitHub webhook ping: {payload.get('zen')}")
+
+    async def on_deploy(self, payload: dict):
+        """
+        Tells broadcast subscribers the bot is about to restart, at most once per DEPLOY_COOLDOWN.
+
+        Parameters
+        ----------
+        payload: dict
+            The request payload, unused.
+        """
+        now = time.monotonic()
+        if self.last_deploy is not None and now - self.last_deploy < DEPLOY_COOLDOWN:
+            print("Restart message already sent recently, skipped")
+            return
+        self.last_deploy = now
+        msg = f"""❕ The bot has received a new update, it will now restart!\n
+        Please resubscribe to receive new notifications.
+        Contact Benji if you require any assistance.
+        (https://t.me/owen97779)"""
+        print("RESTART MESSAGE SENT")
+        queue_notify(msg, self.store.chatids("broadcast_sub"), self.TOKEN)
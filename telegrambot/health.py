@@ -0,0 +1,109 @@
+import time
+import asyncio
+from metrics import STARTUP_SECONDS
+
+
+class Readiness(object):
+    """
+    Readiness class which tracks whether each subsystem has started, and how long after the process started it did,
+    for the health endpoints and the startup report.
+    """
+
+    def __init__(self, started: float = None):
+        """
+        Initialises the Readiness with nothing expected yet.
+
+        Parameters
+        ----------
+        started: float
+            Monotonic time startup began, now if None.
+        """
+        self.started = time.monotonic() if started is None else started
+        self.checks = {}
+        self.ready_at = {}
+
+    def expect(self, name: str, check=None):
+        """
+        Adds a subsystem that must be ready before the bot is.
+
+        Parameters
+        ----------
+        name: str
+            Name of the subsystem.
+        check: callable
+            Function returning whether the subsystem is ready now, if None it is ready once marked.
+        """
+        self.checks[name] = check
+
+    def mark(self, name: str):
+        """
+        Marks a subsystem as ready, the first time only.
+
+        Parameters
+        ----------
+        name: str
+            Name of the subsystem.
+        """
+        if name not in self.ready_at:
+            self.ready_at[name] = time.monotonic() - self.started
+            STARTUP_SECONDS.set(self.ready_at[name], name)
+
+    def status(self):
+        """
+        Function to get every expected subsystem's state.
+
+        Returns
+        -------
+        dict
+            True or False by subsystem name.
+        """
+        status = {}
+        for name, check in self.checks.items():
+            if check is not None and check():
+                self.mark(name)
+                status[name] = True
+            else:
+                status[name] = check is None and name in self.ready_at
+        return status
+
+    def ready(self):
+        """
+        Returns
+        -------
+        bool
+            True if every expected subsystem is ready.
+        """
+        return all(self.status().values())
+
+    async def wait(self, name: str, interval: float = 0.05):
+        """
+        Waits for one subsystem to be marked ready.
+
+        Parameters
+        ----------
+        name: str
+            Name of the subsystem.
+        interval: float
+            Seconds between checks.
+        """
+        while name not in self.ready_at:
+            await asyncio.sleep(interval)
+
+    async def report(self, interval: float = 0.05):
+        """
+        Waits for every subsystem to become ready and prints how long each took.
+
+        Parameters
+        ----------
+        interval: float
+            Seconds between checks.
+        """
+        while not self.ready():
+            await asyncio.sleep(interval)
+        self.mark("bot")
+        times = ", ".join(
+            f"{name} {round(seconds * 1000)} ms"
+            for name, seconds in sorted(self.ready_at.items(), key=lambda item: item[1])
+            if name != "bot"
+        )
+        print(f"Startup: ready in {round(self.ready_at['bot'] * 1000)} ms ({times})")
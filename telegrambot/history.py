@@ -0,0 +1,285 @@
+import math
+import time
+from array import array
+
+# Upper edges in ms of the latency histogram bins, the last bin holds anything slower
+EDGES = (1, 2, 5, 10, 20, 30, 50, 75, 100, 120, 150, 200, 300, 500, 1000)
+BINS = len(EDGES) + 1
+RAW_SIZE = 512
+MINUTE_SIZE = 360  # 6 hours
+HOUR_SIZE = 336  # 14 days
+
+
+def bin_index(rtt: float):
+    """
+    Function to find the histogram bin of a round trip time.
+
+    Parameters
+    ----------
+    rtt: float
+        Round trip time in ms.
+
+    Returns
+    -------
+    int
+        Index of the bin.
+    """
+    for i, edge in enumerate(EDGES):
+        if rtt <= edge:
+            return i
+    return len(EDGES)
+
+
+def percentile(sorted_rtts: list, pct: float):
+    """
+    Function to get a nearest-rank percentile from sorted round trip times.
+
+    Parameters
+    ----------
+    sorted_rtts: list
+        Round trip times in ascending order.
+    pct: float
+        Percentile between 0 and 100.
+
+    Returns
+    -------
+    float or None
+        The percentile, None if there are no samples.
+    """
+    if not sorted_rtts:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_rtts)))
+    return sorted_rtts[rank - 1]
+
+
+def histogram_percentile(hist: list, pct: float):
+    """
+    Function to estimate a percentile from histogram bins, interpolating inside the bin.
+
+    Parameters
+    ----------
+    hist: list
+        Number of samples in each bin.
+    pct: float
+        Percentile between 0 and 100.
+
+    Returns
+    -------
+    float or None
+        The estimated percentile, None if there are no samples.
+    """
+    total = sum(hist)
+    if total == 0:
+        return None
+    rank = max(1, math.ceil(pct / 100 * total))
+    seen = 0
+    for i, count in enumerate(hist):
+        if seen + count >= rank:
+            if i == len(EDGES):
+                return EDGES[-1]
+            lower = EDGES[i - 1] if i else 0
+            return lower + (EDGES[i] - lower) * (rank - seen) / count
+        seen += count
+    return EDGES[-1]
+
+
+class Rollup(object):
+    """
+    Rollup class which keeps a ring of fixed-width time buckets, each holding a lost count and a latency histogram.
+    """
+
+    def __init__(self, width: int, size: int, typecode: str):
+        """
+        Initialises an empty Rollup.
+
+        Parameters
+        ----------
+        width: int
+            Width of each bucket in seconds.
+        size: int
+            Number of buckets kept.
+        typecode: str
+            Array typecode of the counters, big enough for the samples in one bucket.
+        """
+        self.width = width
+        self.size = size
+        self.buckets = array("I", [0]) * size
+        self.counts = array(typecode, [0]) * (size * (BINS + 1))
+
+    def add(self, ts: float, rtt):
+        """
+        Adds a sample to its bucket, clearing the bucket first if it held older data.
+
+        Parameters
+        ----------
+        ts: float
+            Epoch time of the sample.
+        rtt: float or None
+            Round trip time in ms, None if the echo was lost.
+        """
+        bucket = int(ts // self.width)
+        i = bucket % self.size
+        row = i * (BINS + 1)
+        if self.buckets[i] != bucket:
+            self.buckets[i] = bucket
+            for j in range(row, row + BINS + 1):
+                self.counts[j] = 0
+        if rtt is None:
+            self.counts[row] += 1
+        else:
+            self.counts[row + 1 + bin_index(rtt)] += 1
+
+    def summary(self, since: float):
+        """
+        Merges every bucket newer than a time.
+
+        Parameters
+        ----------
+        since: float
+            Epoch time to start from.
+
+        Returns
+        -------
+        tuple
+            The number of lost echoes and the merged histogram.
+        """
+        first = int(since // self.width)
+        lost = 0
+        hist = [0] * BINS
+        for i, bucket in enumerate(self.buckets):
+            if bucket and bucket >= first:
+                row = i * (BINS + 1)
+                lost += self.counts[row]
+                for j in range(BINS):
+                    hist[j] += self.counts[row + 1 + j]
+        return lost, hist
+
+
+class PingHistory(object):
+    """
+    PingHistory class which keeps a host's recent echoes in fixed-size arrays, rolled up into minute and hour buckets.
+    """
+
+    def __init__(self):
+        """
+        Initialises an empty PingHistory, its memory use never grows after this.
+        """
+        self.times = array("d", [0.0]) * RAW_SIZE
+        self.rtts = array("f", [0.0]) * RAW_SIZE
+        self.next = 0
+        self.length = 0
+        self.minutes = Rollup(60, MINUTE_SIZE, "H")
+        self.hours = Rollup(3600, HOUR_SIZE, "I")
+
+    def add(self, rtt, ts: float = None):
+        """
+        Adds one echo.
+
+        Parameters
+        ----------
+        rtt: float or None
+            Round trip time in ms, None if the echo was lost.
+        ts: float
+            Epoch time of the echo, now if None.
+        """
+        if ts is None:
+            ts = time.time()
+        self.times[self.next] = ts
+        self.rtts[self.next] = math.nan if rtt is None else rtt
+        self.next = (self.next + 1) % RAW_SIZE
+        self.length = min(self.length + 1, RAW_SIZE)
+        self.minutes.add(ts, rtt)
+        self.hours.add(ts, rtt)
+
+    def oldest(self):
+        """
+        Returns
+        -------
+        float
+            Epoch time of the oldest echo still held in full, 0 if there are none.
+        """
+        if self.length == 0:
+            return 0
+        return self.times[(self.next - self.length) % RAW_SIZE]
+
+    def recent(self, since: float):
+        """
+        Function to get the raw echoes newer than a time.
+
+        Parameters
+        ----------
+        since: float
+            Epoch time to start from.
+
+        Returns
+        -------
+        list
+            Round trip times in ms, None for lost echoes.
+        """
+        samples = []
+        for k in range(self.length):
+            i = (self.next - self.length + k) % RAW_SIZE
+            if self.times[i] >= since:
+                rtt = self.rtts[i]
+                samples.append(None if math.isnan(rtt) else rtt)
+        return samples
+
+    def query(self, window: float, now: float = None):
+        """
+        Function to get latency percentiles and loss over a window, using the raw echoes
+        when they cover the window and the minute or hour buckets otherwise.
+
+        Parameters
+        ----------
+        window: float
+            Length of the window in seconds.
+        now: float
+            Epoch time the window ends at, now if None.
+
+        Returns
+        -------
+        dict
+            Number of echoes, loss rate and p50/p95/p99 latency in ms.
+        """
+        if now is None:
+            now = time.time()
+        since = now - window
+        if self.length < RAW_SIZE or self.oldest() <= since:
+            samples = self.recent(since)
+            rtts = sorted(rtt for rtt in samples if rtt is not None)
+            total = len(samples)
+            lost = total - len(rtts)
+            p50, p95, p99 = (percentile(rtts, pct) for pct in (50, 95, 99))
+        else:
+            rollup = self.minutes if window <= 60 * MINUTE_SIZE else self.hours
+            lost, hist = rollup.summary(since)
+            total = lost + sum(hist)
+            p50, p95, p99 = (histogram_percentile(hist, pct) for pct in (50, 95, 99))
+        return {
+            "samples": total,
+            "loss": lost / total if total else 0,
+            "p50": p50,
+            "p95": p95,
+            "p99": p99,
+        }
+
+
+def parse_window(text: str):
+    """
+    Function to parse a window such as 30m, 6h or 7d into seconds.
+
+    Parameters
+    ----------
+    text: str
+        A number followed by s, m, h or d, minutes if there is no unit.
+
+    Returns
+    -------
+    int
+        The window in seconds.
+    """
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    text = text.strip().lower()
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text) * 60)
@@ -0,0 +1,192 @@
+import os
+import time
+import socket
+import struct
+import asyncio
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+RESOLVE_TTL = 300
+
+
+def checksum(data: bytes):
+    """
+    Function to calculate the internet checksum of an ICMP packet.
+
+    Parameters
+    ----------
+    data: bytes
+        The ICMP header and payload.
+
+    Returns
+    -------
+    int
+        The 16 bit one's complement checksum.
+    """
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class IcmpMultiplexer(object):
+    """
+    IcmpMultiplexer class which sends echoes to every host through one long-lived ICMP socket and routes replies back by identifier and sequence number.
+    """
+
+    def __init__(self):
+        """
+        Initialises the IcmpMultiplexer, the socket itself is only opened on the first echo.
+        """
+        self.sock = None
+        self.raw = False
+        self.ident = os.getpid() & 0xFFFF
+        self.seq = 0
+        self.pending = {}
+        self.addresses = {}
+
+    def open(self):
+        """
+        Opens the ICMP socket and registers it with the running event loop.
+        Unprivileged datagram ICMP is tried first so the bot also runs as a non-root user,
+        falling back to a raw socket.
+
+        Raises
+        ------
+        OSError
+            If neither socket type can be opened, such as PermissionError without privileges
+            or EPROTONOSUPPORT where the kernel or container does not offer ICMP sockets.
+        """
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            self.raw = False
+        except OSError:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            self.raw = True
+        sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable)
+        self.sock = sock
+
+    def close(self):
+        """
+        Closes the ICMP socket and fails every echo still waiting for a reply.
+        """
+        if self.sock is not None:
+            asyncio.get_running_loop().remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+        for fut, ip, sent in self.pending.values():
+            if not fut.done():
+                fut.set_result(None)
+        self.pending.clear()
+
+    async def resolve(self, host: str):
+        """
+        Function to resolve a FQDN to an IPv4 address without blocking, caching the answer.
+
+        Parameters
+        ----------
+        host: str
+            Pingable FQDN/IP.
+
+        Returns
+        -------
+        str or None
+            The IPv4 address, None if it cannot be resolved.
+        """
+        cached = self.addresses.get(host)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                host, None, family=socket.AF_INET
+            )
+        except (socket.gaierror, UnicodeError, ValueError):
+            # Names like "a..b" or with a label over 63 characters fail to encode
+            return None
+        ip = infos[0][4][0]
+        self.addresses[host] = (ip, time.monotonic() + RESOLVE_TTL)
+        return ip
+
+    def _next_seq(self):
+        """
+        Function to get the next free sequence number.
+
+        Returns
+        -------
+        int
+            A 16 bit sequence number that isn't waiting for a reply.
+        """
+        for i in range(0x10000):
+            self.seq = (self.seq + 1) & 0xFFFF
+            if self.seq not in self.pending:
+                return self.seq
+        raise RuntimeError("Too many echoes in flight")
+
+    async def ping(self, host: str, timeout: float = 1):
+        """
+        Function to send one echo to a host and wait for its reply.
+
+        Parameters
+        ----------
+        host: str
+            Pingable FQDN/IP.
+        timeout: float
+            Seconds to wait for the reply.
+
+        Returns
+        -------
+        float or None
+            Round trip time in seconds, None if the echo was lost.
+        """
+        if self.sock is None:
+            self.open()
+        ip = await self.resolve(host)
+        if ip is None:
+            return None
+        seq = self._next_seq()
+        payload = struct.pack("!d", time.perf_counter()).ljust(56, b"\x00")
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, self.ident, seq)
+        header = struct.pack(
+            "!BBHHH", ICMP_ECHO_REQUEST, 0, checksum(header + payload), self.ident, seq
+        )
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[seq] = (fut, ip, time.perf_counter())
+        try:
+            self.sock.sendto(header + payload, (ip, 0))
+            return await asyncio.wait_for(fut, timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        finally:
+            self.pending.pop(seq, None)
+
+    def _on_readable(self):
+        """
+        Callback run by the event loop when replies are waiting on the socket.
+        """
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            received = time.perf_counter()
+            if self.raw:
+                # Raw sockets hand over the IPv4 header as well
+                data = data[(data[0] & 0x0F) * 4 :]
+            if len(data) < 8:
+                continue
+            icmp_type, code, csum, ident, seq = struct.unpack("!BBHHH", data[:8])
+            # Datagram sockets rewrite the identifier, but the kernel only
+            # delivers replies for this socket so the sequence number is enough
+            if icmp_type != ICMP_ECHO_REPLY or (self.raw and ident != self.ident):
+                continue
+            entry = self.pending.get(seq)
+            if entry is None:
+                continue
+            fut, ip, sent = entry
+            if ip == addr[0] and not fut.done():
+                fut.set_result(received - sent)
@@ -0,0 +1,308 @@
+import time
+from bisect import bisect_left
+from history import EDGES
+
+# Upper edges in seconds of the latency histograms, other than ping round trip times
+SECONDS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+registry = []
+
+
+def format_labels(names: tuple, values: tuple, extra: str = ""):
+    """
+    Function to format the labels of one sample.
+
+    Parameters
+    ----------
+    names: tuple
+        Label names.
+    values: tuple
+        Label values in the same order.
+    extra: str
+        An already formatted label to add, such as le="0.5".
+
+    Returns
+    -------
+    str
+        The labels in braces, an empty string if there are none.
+    """
+    pairs = []
+    for name, value in zip(names, values):
+        value = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        pairs.append(f'{name}="{value}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float):
+    """
+    Function to format a sample value.
+
+    Parameters
+    ----------
+    value: float
+        The value.
+
+    Returns
+    -------
+    str
+        The value, without a decimal point if it is whole.
+    """
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric(object):
+    """
+    Metric class which holds one value per set of label values and is registered for the /metrics page.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        """
+        Initialises the Metric and registers it.
+
+        Parameters
+        ----------
+        name: str
+            The metric name.
+        description: str
+            Help text shown on the /metrics page.
+        labels: tuple
+            Label names.
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        registry.append(self)
+
+    def remove(self, *labels):
+        """
+        Forgets the value of one set of label values, such as a removed host.
+
+        Parameters
+        ----------
+        labels: str
+            The label values.
+        """
+        self.values.pop(labels, None)
+
+    def samples(self):
+        """
+        Yields
+        ------
+        str
+            One line per sample in the Prometheus text format.
+        """
+        for labels, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+
+    def render(self):
+        """
+        Returns
+        -------
+        str
+            The metric in the Prometheus text format.
+        """
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    Counter class for values which only go up, such as the number of messages received.
+    """
+
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        """
+        Adds to the counter.
+
+        Parameters
+        ----------
+        labels: str
+            The label values.
+        amount: float
+            How much to add.
+        """
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Gauge class for values which go up and down, such as the event loop lag.
+    """
+
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        """
+        Sets the gauge.
+
+        Parameters
+        ----------
+        value: float
+            The new value.
+        labels: str
+            The label values.
+        """
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """
+    Histogram class which counts observations into fixed buckets and keeps their sum.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, description: str, buckets: tuple = SECONDS, labels: tuple = ()
+    ):
+        """
+        Initialises the Histogram and registers it.
+
+        Parameters
+        ----------
+        name: str
+            The metric name.
+        description: str
+            Help text shown on the /metrics page.
+        buckets: tuple
+            Upper edges of the buckets in ascending order, a +Inf bucket is added.
+        labels: tuple
+            Label names.
+        """
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        """
+        Adds an observation.
+
+        Parameters
+        ----------
+        value: float
+            The observed value.
+        labels: str
+            The label values.
+        """
+        counts = self.values.get(labels)
+        if counts is None:
+            # One count per bucket, the +Inf bucket, then the sum
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        """
+        Yields
+        ------
+        str
+            The cumulative bucket, sum and count lines of each set of label values.
+        """
+        edges = [format_value(edge) for edge in self.buckets] + ["+Inf"]
+        for labels, counts in self.values.items():
+            total = 0
+            for edge, count in zip(edges, counts):
+                total += count
+                le = format_labels(self.labels, labels, f'le="{edge}"')
+                yield f"{self.name}_bucket{le} {total}"
+            labels = format_labels(self.labels, labels)
+            yield f"{self.name}_sum{labels} {format_value(counts[-1])}"
+            yield f"{self.name}_count{labels} {total}"
+
+
+class Timer(object):
+    """
+    Timer context manager which observes how long its block took into a Histogram.
+    """
+
+    def __init__(self, histogram: Histogram, *labels):
+        """
+        Initialises the Timer.
+
+        Parameters
+        ----------
+        histogram: Histogram
+            The histogram to observe into.
+        labels: str
+            The label values.
+        """
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+def render():
+    """
+    Function to render every registered metric.
+
+    Returns
+    -------
+    str
+        The /metrics page in the Prometheus text format.
+    """
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+PING_RTT = Histogram(
+    "pachamama_ping_rtt_ms",
+    "Round trip time of answered echoes in ms",
+    EDGES,
+    ("host",),
+)
+PING_ECHOES = Counter("pachamama_ping_echoes_total", "Echoes sent", ("host",))
+PING_LOST = Counter("pachamama_ping_lost_total", "Echoes not answered", ("host",))
+SWEEP_SECONDS = Histogram(
+    "pachamama_sweep_seconds", "Time taken to ping the hosts due in one sweep"
+)
+LOOP_LAG = Gauge("pachamama_loop_lag_last_seconds", "Latest event loop lag")
+LOOP_LAG_SECONDS = Histogram("pachamama_loop_lag_seconds", "Event loop lag")
+LOOP_STALLS = Counter(
+    "pachamama_loop_stalls_total", "Times the event loop was blocked over the threshold"
+)
+NOTIFY_SECONDS = Histogram(
+    "pachamama_notify_seconds",
+    "Time to deliver a message to one chat, including rate limiting and retries",
+)
+NOTIFY_RESULTS = Counter(
+    "pachamama_notify_total", "Messages sent to one chat by result", ("result",)
+)
+TELEGRAM_429 = Counter(
+    "pachamama_telegram_429_total", "Flood control (HTTP 429) responses from Telegram"
+)
+MQTT_MESSAGES = Counter("pachamama_mqtt_messages_total", "CCTV MQTT messages received")
+MQTT_PARSE_ERRORS = Counter(
+    "pachamama_mqtt_parse_errors_total", "CCTV MQTT payloads rejected by the parser"
+)
+STARTUP_SECONDS = Gauge(
+    "pachamama_startup_seconds",
+    "Seconds from process start until each subsystem was ready",
+    ("subsystem",),
+)
+TASK_RESTARTS = Counter(
+    "pachamama_task_restarts_total", "Background task restarts after a crash", ("task",)
+)
+STORE_WRITE_SECONDS = Histogram(
+    "pachamama_store_write_seconds",
+    "Time taken to persist a store change",
+    labels=("backend",),
+)
@@ -0,0 +1,207 @@
+import time
+import asyncio
+import sqlite3
+import threading
+from utils import FAILED, SENT
+
+RETRY_DELAY = 30  # seconds before the first retry, doubled on each one after
+MAX_RETRY_DELAY = 900
+
+
+class Outbox(object):
+    """
+    Outbox class which journals notifications to SQLite and hands them to background sender workers,
+    so producers never wait on Telegram or on the disk, and unsent alerts survive a restart and outages.
+    """
+
+    def __init__(self, notifier, path: str, workers: int = 4):
+        """
+        Initialises the Outbox, opening the journal and queueing anything left unsent by the last run.
+
+        Parameters
+        ----------
+        notifier: Notifier
+            The notifier used to send each message.
+        path: str
+            The name of the SQLite journal file.
+        workers: int
+            Number of sender workers.
+        """
+        self.notifier = notifier
+        self.path = path
+        self.workers = workers
+        self.queue = asyncio.Queue()
+        self.unjournalled = []
+        self.journalling = None
+        self.retrying = 0  # messages waiting out a retry delay, outside the queue
+        # Used from worker threads, one at a time
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chatid TEXT NOT NULL,
+                text TEXT NOT NULL,
+                created REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )""")
+        self.db.commit()
+        for row in self.db.execute("SELECT id, chatid, text, attempts FROM outbox"):
+            self.queue.put_nowait(row)
+        if self.queue.qsize():
+            print(f"Outbox: {self.queue.qsize()} unsent notifications restored")
+
+    def put(self, msg: str, chatids):
+        """
+        Queues a message for each chat ID to be journalled, without waiting for the disk or for delivery.
+        Messages put while a batch is being written are journalled together in the next one.
+
+        Parameters
+        ----------
+        msg: str
+            The message to send.
+        chatids: list
+            List of chat IDs.
+        """
+        now = time.time()
+        self.unjournalled.extend((str(chatid), msg, now) for chatid in chatids)
+        if self.journalling is None or self.journalling.done():
+            self.journalling = asyncio.get_running_loop().create_task(self.journal())
+
+    async def journal(self):
+        """
+        Writes the queued messages to the journal in batches in a thread, then hands them to the workers.
+        """
+        while self.unjournalled:
+            batch, self.unjournalled = self.unjournalled, []
+            try:
+                rowids = await asyncio.to_thread(self.insert, batch)
+            except sqlite3.Error as e:
+                # Still sent, they just would not survive a restart
+                print(f"Outbox: could not journal {len(batch)} notifications: {e}")
+                rowids = [None] * len(batch)
+            for rowid, (chatid, msg, created) in zip(rowids, batch):
+                self.queue.put_nowait((rowid, chatid, msg, 0))
+
+    def insert(self, batch: list):
+        """
+        Function to journal a batch of messages in one transaction.
+
+        Parameters
+        ----------
+        batch: list
+            (chat ID, message, time created) tuples.
+
+        Returns
+        -------
+        list
+            The row IDs of the messages, in order.
+        """
+        with self.lock, self.db:
+            return [
+                self.db.execute(
+                    "INSERT INTO outbox (chatid, text, created) VALUES (?, ?, ?)", row
+                ).lastrowid
+                for row in batch
+            ]
+
+    def execute(self, sql: str, *args):
+        """
+        Function to run one statement on the journal in its own transaction.
+
+        Parameters
+        ----------
+        sql: str
+            The statement.
+        args: tuple
+            Its parameters.
+        """
+        with self.lock, self.db:
+            self.db.execute(sql, args)
+
+    async def worker(self):
+        """
+        Sender worker which delivers queued messages one at a time. Messages which could not be sent
+        for now, such as during flood control or a network outage, stay journalled and are retried
+        with a growing delay, only those Telegram refused outright are dropped.
+        """
+        while True:
+            rowid, chatid, msg, attempts = await self.queue.get()
+            try:
+                result = await self.notifier.send(chatid, msg)
+            except Exception as e:
+                print(f"Outbox: error sending to {chatid}: {e}")
+                result = None
+            try:
+                if result in (SENT, FAILED):
+                    if result == FAILED:
+                        print(f"Outbox: giving up on {chatid}")
+                    if rowid is not None:
+                        await asyncio.to_thread(
+                            self.execute, "DELETE FROM outbox WHERE id = ?", rowid
+                        )
+                else:
+                    if rowid is not None:
+                        await asyncio.to_thread(
+                            self.execute,
+                            "UPDATE outbox SET attempts = attempts + 1 WHERE id = ?",
+                            rowid,
+                        )
+                    self.retrying += 1
+                    asyncio.get_running_loop().call_later(
+                        min(RETRY_DELAY * 2**attempts, MAX_RETRY_DELAY),
+                        self.retry,
+                        (rowid, chatid, msg, attempts + 1),
+                    )
+            except sqlite3.Error as e:
+                print(f"Outbox: could not update the journal for {chatid}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def retry(self, item: tuple):
+        """
+        Queues a message again once its retry delay is over.
+
+        Parameters
+        ----------
+        item: tuple
+            The row ID, chat ID, message and number of attempts so far.
+        """
+        self.retrying -= 1
+        self.queue.put_nowait(item)
+
+    async def run(self):
+        """
+        Runs the sender workers until cancelled.
+        """
+        await asyncio.gather(*(self.worker() for i in range(self.workers)))
+
+    async def wait_sent(self):
+        """
+        Waits until everything put has been journalled and handed to the workers, and the queue is empty.
+        """
+        while self.journalling is not None and not self.journalling.done():
+            await self.journalling
+        await self.queue.join()
+
+    async def drain(self, timeout: float):
+        """
+        Waits for the queue to empty, anything unsent after the timeout or waiting to be retried
+        stays in the journal for the next run.
+
+        Parameters
+        ----------
+        timeout: float
+            Seconds to wait.
+
+        Returns
+        -------
+        bool
+            True if everything was delivered.
+        """
+        try:
+            await asyncio.wait_for(self.wait_sent(), timeout)
+            return self.retrying == 0
+        except asyncio.TimeoutError:
+            return False
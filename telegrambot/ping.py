@@ -1,14 +1,55 @@
+import time
 import asyncio
-from ping3 import ping
+from history import PingHistory
+from status import StatusMachine
 from utils import notify
+from metrics import PING_RTT, PING_ECHOES, PING_LOST
+
+
+class PingInfo(object):
+    """
+    PingInfo class which holds the raw result of a host's latest sweep, rounded only when it is shown.
+    """
+
+    __slots__ = ("average_ping", "ping_count", "status", "success_rate", "ping_times")
+
+    def __init__(self):
+        """
+        Initialises an empty PingInfo for a host that has not been pinged.
+        """
+        self.average_ping = 0.0
+        self.ping_count = 0
+        self.status = False
+        self.success_rate = 0.0
+        self.ping_times = ()
+
+    def update(self, ping_times: list, max_count: int):
+        """
+        Function to fill the record in place from a list of round trip times.
+
+        Parameters
+        ----------
+        ping_times: list
+            Round trip times of each echo, None for lost echoes, kept as the ping times.
+        max_count: int
+            Number of echoes that were sent.
+        """
+        answered = [ping_ for ping_ in ping_times if ping_ is not None]
+        self.average_ping = sum(answered) / len(answered) if answered else 0.0
+        self.ping_count = len(answered)
+        self.status = len(answered) > 0
+        self.success_rate = len(answered) / max_count if max_count else 0.0
+        self.ping_times = ping_times
 
 
 class Host(object):
     """
-    Host class to ping only instantiated host objects and keep track of flags.
+    Host class to ping only instantiated host objects and keep track of their status.
     """
 
-    def __init__(self, host_name: str, ip: str):
+    __slots__ = ("host_name", "ip", "pinginfo", "history", "probed_at", "status")
+
+    def __init__(self, host_name: str, ip: str, thresholds=None):
         """
         Function to instantiate the Host class as an object which can be pinged.
 
@@ -18,143 +59,52 @@ class Host(object):
             Name of the host.
         ip: str
             Pingable FQDN/IP.
+        thresholds: Thresholds
+            Settings of the status state machine, the defaults if None.
         """
         self.host_name = host_name
         self.ip = ip
-        self.pinginfo = {
-            "average_ping": 0,
-            "ping_count": 0,
-            "status": False,
-            "success_rate": 0,
-            "ping_times": [],
-        }
-        self.down_notify_flag = False
-        self.old_down_notify_flag = False
-        self.amber_notify_flag = False
-        self.old_amber_notify_flag = False
-        self.red_notify_flag = False
-        self.old_red_notify_flag = False
+        self.pinginfo = PingInfo()
+        self.history = PingHistory()
+        self.probed_at = None
+        self.status = StatusMachine(thresholds)
 
-    def ping(self, max_count: int, unit="ms"):
+    def record(self, ping_times: list, max_count: int):
         """
-        Function to fill the pinginfo dictionary with ping information using averages.
+        Function to add a sweep's round trip times to the history and metrics and update the pinginfo record.
 
         Parameters
         ----------
+        ping_times: list
+            Round trip times of each echo, None for lost echoes, kept as the latest ping times.
         max_count: int
-            Number of times to ping the host.
-        unit: str
-            Unit of time to measure ping in.
-        """
-        ping_total = 0
-        ping_count = 0
-        ping_time = []
-        for i in range(max_count):
-            ping_ = ping(dest_addr=self.ip, unit=unit, timeout=1)
-            if ping_ == None:
-                print(f"{self.host_name} - Ping failed")
-            else:
-                ping_total += ping_
-                ping_count += 1
-                ping_time.append(round(ping_, 2))
-        if ping_count == 0:
-            self.pinginfo["average_ping"] = 0
-            self.pinginfo["ping_count"] = 0
-            self.pinginfo["status"] = False
-            self.pinginfo["success_rate"] = 0
-            self.pinginfo["ping_times"] = ["N/A"]
-        else:
-            average_ping = ping_total / ping_count
-            self.pinginfo["average_ping"] = round(average_ping, 2)
-            self.pinginfo["ping_count"] = ping_count
-            self.pinginfo["status"] = True
-            self.pinginfo["success_rate"] = ping_count / max_count
-            self.pinginfo["ping_times"] = ping_time
+            Number of echoes that were sent.
+        """
+        self.probed_at = time.monotonic()
+        for ping_ in ping_times:
+            self.history.add(ping_)
+            if ping_ is not None:
+                PING_RTT.observe(ping_, self.host_name)
+        self.pinginfo.update(ping_times, max_count)
+        PING_ECHOES.inc(self.host_name, amount=len(ping_times))
+        PING_LOST.inc(self.host_name, amount=len(ping_times) - self.pinginfo.ping_count)
 
-    def reset_flags(self):
-        """
-        Function to reset all flags to False.
+    def evaluate(self):
         """
-        self.old_down_notify_flag = self.down_notify_flag
-        self.old_amber_notify_flag = self.amber_notify_flag
-        self.old_red_notify_flag = self.red_notify_flag
+        Function to feed the latest sweep and the rolling latency into the status state machine.
 
-        self.down_notify_flag = False
-        self.amber_notify_flag = False
-        self.red_notify_flag = False
-
-    def check_flag_change(self):
-        """
-        Function to check if any flags have changed.
-        Returns
-        -------
-        bool
-            True if any flags have changed, False if not.
-        """
-        if (
-            self.old_down_notify_flag != self.down_notify_flag
-            or self.old_amber_notify_flag != self.amber_notify_flag
-            or self.old_red_notify_flag != self.red_notify_flag
-        ):
-            return True
-        else:
-            return False
-
-    def green(self):
-        """
-        Function to reset all flags and check if any flags have changed.
-        Returns
-        -------
-        int
-            0 if no flags have changed, -1 if flags have changed.
-        """
-        self.reset_flags()
-        if self.check_flag_change():
-            return 0
-        else:
-            return -1
-
-    def amber(self):
-        """
-        Function to set amber flag and check if any flags have changed.
-        Returns
-        -------
-        int
-            1 if amber flag has changed, -1 if flags have changed.
-        """
-        self.reset_flags()
-        self.amber_notify_flag = True
-        if self.check_flag_change():
-            return 1
-        else:
-            return -1
-
-    def red(self):
-        """
-        Function to set red flag and check if any flags have changed.
         Returns
         -------
         int
-            2 if red flag has changed, -1 if flags have changed.
-        """
-        self.reset_flags()
-        self.red_notify_flag = True
-        if self.check_flag_change():
-            return 2
-        else:
-            return -1
-
-    def down(self):
-        """
-        Function to set down flag and check if any flags have changed.
-        Returns
-        -------
-        int
-            3 if down flag has changed, -1 if flags have changed.
-        """
-        self.reset_flags()
-        self.down_notify_flag = True
-        if self.check_flag_change():
-            return 3
-        else:
-            return -1
+            0 green, 1 amber, 2 red or 3 down if the status changed and should be notified, -1 if not.
+        """
+        stats = self.history.query(self.status.thresholds.latency_window)
+        latency = stats["p50"] or 0
+        flapping = self.status.flapping
+        error_code = self.status.update(self.pinginfo.status, latency)
+        if self.status.flapping != flapping:
+            if self.status.flapping:
+                print(f"{self.host_name} is flapping, notifications suppressed")
+            else:
+                print(f"{self.host_name} stopped flapping")
+        return error_code
@@ -0,0 +1,143 @@
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prober(object):
+    """
+    Prober class which sends ICMP echoes to many hosts at the same time without blocking the event loop.
+    """
+
+    def __init__(
+        self, concurrency: int = 64, timeout: float = 1, unit="ms", multiplexer=None
+    ):
+        """
+        Initialises the Prober with a limit on how many echoes can be in flight at once.
+
+        Parameters
+        ----------
+        concurrency: int
+            Maximum number of echoes waiting for a reply at the same time.
+        timeout: float
+            Seconds to wait for each echo reply.
+        unit: str
+            Unit of time to measure ping in.
+        multiplexer: IcmpMultiplexer
+            Shared ICMP socket to send echoes through, ping3 is used in threads if None.
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.unit = unit
+        self.multiplexer = multiplexer
+        self.ping3_failed = False
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="probe"
+        )
+
+    async def echo(self, ip: str):
+        """
+        Function to send a single echo to a host off the event loop.
+
+        Parameters
+        ----------
+        ip: str
+            Pingable FQDN/IP.
+
+        Returns
+        -------
+        float or None
+            Round trip time, None if the echo was lost.
+        """
+        async with self.semaphore:
+            if self.multiplexer is not None:
+                try:
+                    rtt = await self.multiplexer.ping(ip, self.timeout)
+                except OSError as e:
+                    # Only the first echo gets here, the others see no multiplexer
+                    print(f"ICMP socket unavailable ({e}), falling back to ping3")
+                    self.multiplexer = None
+                else:
+                    if rtt is None:
+                        return None
+                    return rtt * 1000 if self.unit == "ms" else rtt
+            from ping3 import ping  # only needed without the ICMP socket
+
+            loop = asyncio.get_running_loop()
+            try:
+                ping_ = await loop.run_in_executor(
+                    self.executor,
+                    partial(ping, dest_addr=ip, unit=self.unit, timeout=self.timeout),
+                )
+            except OSError as e:
+                # Counted as lost rather than failing the whole sweep
+                if not self.ping3_failed:
+                    print(f"ping3 cannot open an ICMP socket either: {e}")
+                    self.ping3_failed = True
+                return None
+        # ping3 returns False on errors such as an unresolvable host
+        if ping_ is None or ping_ is False:
+            return None
+        return ping_
+
+    async def measure(self, host, max_count: int):
+        """
+        Function to ping a host max_count times concurrently without recording the result on the host.
+        Echoes that fail with an error count as lost, so one bad host can't fail a sweep.
+
+        Parameters
+        ----------
+        host: Host
+            The host to be pinged.
+        max_count: int
+            Number of echoes to send.
+
+        Returns
+        -------
+        list
+            Round trip times of each echo, None for lost echoes.
+        """
+        results = await asyncio.gather(
+            *(self.echo(host.ip) for i in range(max_count)), return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            print(f"Could not ping {host.host_name}: {errors[0]!r}")
+        return [None if isinstance(result, Exception) else result for result in results]
+
+    async def probe(self, host, max_count: int):
+        """
+        Function to ping a host max_count times concurrently and record the result on the host.
+
+        Parameters
+        ----------
+        host: Host
+            The host to be pinged.
+        max_count: int
+            Number of echoes to send.
+
+        Returns
+        -------
+        Host
+            The host that was pinged.
+        """
+        host.record(await self.measure(host, max_count), max_count)
+        return host
+
+    async def sweep(self, hosts, max_count: int):
+        """
+        Function to ping every host at the same time, so a sweep takes as long as the slowest host.
+
+        Parameters
+        ----------
+        hosts: iterable
+            The hosts to be pinged.
+        max_count: int
+            Number of echoes to send to each host.
+
+        Returns
+        -------
+        list
+            The hosts that were pinged.
+        """
+        return await asyncio.gather(*(self.probe(host, max_count) for host in hosts))
@@ -0,0 +1,60 @@
+import time
+import asyncio
+
+
+class TokenBucket(object):
+    """
+    TokenBucket class which spaces out calls so they stay under a rate, while allowing short bursts.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Initialises the TokenBucket full.
+
+        Parameters
+        ----------
+        rate: float
+            Tokens added per second.
+        capacity: float
+            Maximum number of tokens, which is the largest burst allowed.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def reserve(self):
+        """
+        Function to take one token, going into debt if none are left.
+
+        Returns
+        -------
+        float
+            Seconds to wait before the token can be used.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = 0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.paused_until - now)
+
+    async def acquire(self):
+        """
+        Function to wait until a token is available.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        Function to stop handing out tokens for a while, such as after a flood control error.
+
+        Parameters
+        ----------
+        seconds: float
+            Seconds to pause for.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
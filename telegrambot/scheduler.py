@@ -0,0 +1,166 @@
+import time
+import heapq
+import random
+from status import GREEN, DOWN
+
+
+class Scheduler(object):
+    """
+    Scheduler class which gives every host its own next probe time in a priority queue.
+    Healthy hosts back off to a longer interval while suspect and down hosts are probed more often.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 5,
+        base_interval: float = 10,
+        max_interval: float = 60,
+        backoff_after: int = 6,
+        jitter: float = 0.1,
+    ):
+        """
+        Initialises an empty Scheduler.
+
+        Parameters
+        ----------
+        min_interval: float
+            Seconds between probes of a down or suspect host.
+        base_interval: float
+            Seconds between probes of an amber or red host, and of a green host that only just recovered.
+        max_interval: float
+            Longest number of seconds between probes of a healthy host.
+        backoff_after: int
+            Number of healthy probes in a row after which a green host's interval doubles.
+        jitter: float
+            Fraction each interval is randomly stretched or shrunk by, so probes don't line up.
+        """
+        self.min_interval = min_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.backoff_after = backoff_after
+        self.jitter = jitter
+        self.heap = []
+        self.due = {}
+        self.streaks = {}
+
+    def push(self, host_name: str, due: float):
+        """
+        Sets when a host is next due.
+
+        Parameters
+        ----------
+        host_name: str
+            Name of the host.
+        due: float
+            Monotonic time the host is due.
+        """
+        self.due[host_name] = due
+        heapq.heappush(self.heap, (due, host_name))
+
+    def sync(self, hostobj: dict, now: float = None):
+        """
+        Adds new hosts with start times spread over one base interval, and forgets removed hosts.
+        Hosts that were taken to be probed but never rescheduled, such as when a sweep failed, are added again.
+
+        Parameters
+        ----------
+        hostobj: dict
+            Dictionary of Host objects by name.
+        now: float
+            Monotonic time now, now if None.
+        """
+        if now is None:
+            now = time.monotonic()
+        for host_name in hostobj:
+            if self.due.get(host_name) is None:
+                self.push(host_name, now + random.uniform(0, self.base_interval))
+        for host_name in list(self.due):
+            if host_name not in hostobj:
+                del self.due[host_name]
+                self.streaks.pop(host_name, None)
+
+    def pop_due(self, now: float = None):
+        """
+        Function to take every host whose probe is due, they have no next probe time until they are rescheduled.
+
+        Parameters
+        ----------
+        now: float
+            Monotonic time now, now if None.
+
+        Returns
+        -------
+        list
+            Names of the due hosts.
+        """
+        if now is None:
+            now = time.monotonic()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            when, host_name = heapq.heappop(self.heap)
+            # Entries of removed or rescheduled hosts are skipped
+            if self.due.get(host_name) == when:
+                self.due[host_name] = None
+                due.append(host_name)
+        return due
+
+    def next_due(self):
+        """
+        Returns
+        -------
+        float or None
+            Monotonic time the next host is due, None if there are no hosts.
+        """
+        while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def interval(self, host):
+        """
+        Function to work out how long to wait before probing a host again.
+
+        Parameters
+        ----------
+        host: Host
+            The host that was just probed.
+
+        Returns
+        -------
+        float
+            Seconds until the next probe.
+        """
+        status = host.status
+        suspect = status.candidates and status.candidates[-1] != status.state
+        if status.state == DOWN or suspect:
+            self.streaks[host.host_name] = 0
+            return self.min_interval
+        if status.state != GREEN:
+            self.streaks[host.host_name] = 0
+            return self.base_interval
+        streak = self.streaks.get(host.host_name, 0) + 1
+        interval = min(
+            self.max_interval, self.base_interval * 2 ** (streak // self.backoff_after)
+        )
+        # The streak stops growing once the interval is as long as it gets, so it can't overflow
+        if interval < self.max_interval:
+            self.streaks[host.host_name] = streak
+        return interval
+
+    def reschedule(self, host, now: float = None):
+        """
+        Schedules a host's next probe from its status.
+
+        Parameters
+        ----------
+        host: Host
+            The host that was just probed.
+        now: float
+            Monotonic time now, now if None.
+        """
+        if now is None:
+            now = time.monotonic()
+        if host.host_name not in self.due:
+            return
+        interval = self.interval(host)
+        interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.push(host.host_name, now + interval)
@@ -0,0 +1,185 @@
+import time
+import sqlite3
+import datetime
+
+
+class SessionLog(object):
+    """
+    SessionLog class which appends every CCTV login and logout to SQLite with its real timestamp,
+    keeps each member's latest state alongside so it can be restored at startup, and works out shifts from the
+    events in a time range using an index instead of reading the whole log.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialises the SessionLog, creating its tables and indexes if needed.
+
+        Parameters
+        ----------
+        path: str
+            The name of the SQLite file.
+        """
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS cctv_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                ts REAL NOT NULL,
+                login INTEGER NOT NULL
+            )""")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS cctv_events_name_ts ON cctv_events (name, ts)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS cctv_events_ts ON cctv_events (ts)")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS cctv_members (
+                name TEXT PRIMARY KEY,
+                logged_in INTEGER NOT NULL,
+                login_ts REAL,
+                logout_ts REAL
+            )""")
+        self.db.commit()
+
+    def append(self, name: str, login: bool, ts: float = None):
+        """
+        Appends a login or logout event and updates the member's latest state.
+
+        Parameters
+        ----------
+        name: str
+            Name of the member.
+        login: bool
+            True for a login, False for a logout.
+        ts: float
+            Unix time of the event, now if None.
+        """
+        if ts is None:
+            ts = time.time()
+        column = "login_ts" if login else "logout_ts"
+        with self.db:
+            self.db.execute(
+                "INSERT INTO cctv_events (name, ts, login) VALUES (?, ?, ?)",
+                (name, ts, int(login)),
+            )
+            self.db.execute(
+                f"""INSERT INTO cctv_members (name, logged_in, {column}) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET logged_in = excluded.logged_in,
+                {column} = excluded.{column}""",
+                (name, int(login), ts),
+            )
+
+    def members(self):
+        """
+        Function to get every member's latest state.
+
+        Returns
+        -------
+        dict
+            Tuples of (logged_in, login_ts, logout_ts) by member name, the times are None if never seen.
+        """
+        return {
+            name: (bool(logged_in), login_ts, logout_ts)
+            for name, logged_in, login_ts, logout_ts in self.db.execute(
+                "SELECT name, logged_in, login_ts, logout_ts FROM cctv_members"
+            )
+        }
+
+    def shifts(self, start: float, end: float = None, name: str = None):
+        """
+        Function to pair logins and logouts into shifts within a time range.
+        A shift already running at the start of the range is clipped to it, and one still running is clipped to the end.
+
+        Parameters
+        ----------
+        start: float
+            Unix time the range starts.
+        end: float
+            Unix time the range ends, now if None.
+        name: str
+            Only this member's shifts, everyone's if None.
+
+        Returns
+        -------
+        list
+            Tuples of (name, start, end, ongoing) sorted by name then start.
+        """
+        if end is None:
+            end = time.time()
+        names = [name] if name else sorted(self.members())
+        shifts = []
+        for member in names:
+            events = self.db.execute(
+                """SELECT ts, login FROM cctv_events WHERE name = ? AND ts < ?
+                ORDER BY ts DESC LIMIT 1""",
+                (member, start),
+            ).fetchall()
+            events += self.db.execute(
+                """SELECT ts, login FROM cctv_events WHERE name = ? AND ts >= ? AND ts < ?
+                ORDER BY ts""",
+                (member, start, end),
+            ).fetchall()
+            opened = None
+            for ts, login in events:
+                if login:
+                    # A repeated login keeps the earlier one
+                    if opened is None:
+                        opened = ts
+                elif opened is not None:
+                    shifts.append((member, max(opened, start), ts, False))
+                    opened = None
+            if opened is not None:
+                shifts.append((member, max(opened, start), end, True))
+        return shifts
+
+    def totals(self, start: float, end: float = None, name: str = None):
+        """
+        Function to add up each member's shift time per local day within a time range,
+        shifts over midnight are split between the days.
+
+        Parameters
+        ----------
+        start: float
+            Unix time the range starts.
+        end: float
+            Unix time the range ends, now if None.
+        name: str
+            Only this member's totals, everyone's if None.
+
+        Returns
+        -------
+        dict
+            Dictionaries of seconds by date, by member name.
+        """
+        totals = {}
+        for member, begin, finish, ongoing in self.shifts(start, end, name):
+            days = totals.setdefault(member, {})
+            while begin < finish:
+                day = datetime.date.fromtimestamp(begin)
+                midnight = datetime.datetime.combine(
+                    day + datetime.timedelta(days=1), datetime.time()
+                ).timestamp()
+                stop = min(finish, midnight)
+                days[day] = days.get(day, 0) + stop - begin
+                begin = stop
+        return totals
+
+
+def format_duration(seconds: float):
+    """
+    Function to format a duration such as 3h 20m.
+
+    Parameters
+    ----------
+    seconds: float
+        The duration in seconds.
+
+    Returns
+    -------
+    str
+        The duration in hours and minutes.
+    """
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes}m"
+    return f"{minutes // 60}h {minutes % 60}m"
@@ -0,0 +1,167 @@
+import enum
+import time
+from collections import deque
+
+
+class State(enum.IntEnum):
+    """
+    State of a host, the values match the error codes the bot has always used.
+    """
+
+    GREEN = 0
+    AMBER = 1
+    RED = 2
+    DOWN = 3
+
+
+GREEN = State.GREEN
+AMBER = State.AMBER
+RED = State.RED
+DOWN = State.DOWN
+
+
+class Thresholds(object):
+    """
+    Thresholds class which holds the settings of the host status state machine.
+    """
+
+    def __init__(
+        self,
+        amber_enter: float = 120,
+        amber_exit: float = 100,
+        red_enter: float = 200,
+        red_exit: float = 180,
+        confirm: int = 3,
+        window: int = 4,
+        latency_window: float = 60,
+        flap_window: float = 900,
+        flap_limit: int = 4,
+    ):
+        """
+        Initialises the Thresholds, a state is entered above its enter threshold and only left below its exit threshold.
+
+        Parameters
+        ----------
+        amber_enter: float
+            Latency in ms above which a host turns amber.
+        amber_exit: float
+            Latency in ms an amber host must drop to before it turns green.
+        red_enter: float
+            Latency in ms at which a host turns red.
+        red_exit: float
+            Latency in ms a red host must drop below before it turns amber.
+        confirm: int
+            Number of sweeps out of the last window that must agree before the state changes (N of M).
+        window: int
+            Number of sweeps the confirmation looks at (M).
+        latency_window: float
+            Seconds of ping history the latency is taken from.
+        flap_window: float
+            Seconds over which state changes are counted to detect flapping.
+        flap_limit: int
+            Number of state changes within flap_window that mark a host as flapping.
+        """
+        self.amber_enter = amber_enter
+        self.amber_exit = amber_exit
+        self.red_enter = red_enter
+        self.red_exit = red_exit
+        self.confirm = confirm
+        self.window = window
+        self.latency_window = latency_window
+        self.flap_window = flap_window
+        self.flap_limit = flap_limit
+
+
+class StatusMachine(object):
+    """
+    StatusMachine class which moves a host between green, amber, red and down with hysteresis,
+    N of M confirmation and flap suppression, so only settled changes are notified.
+    Flap suppression only holds back the churn between green, amber and red, going down
+    and recovering from it are always notified.
+    """
+
+    __slots__ = ("thresholds", "state", "notified", "flapping", "candidates", "changes")
+
+    def __init__(self, thresholds: Thresholds = None):
+        """
+        Initialises the StatusMachine as green.
+
+        Parameters
+        ----------
+        thresholds: Thresholds
+            The settings to use, the defaults if None.
+        """
+        self.thresholds = thresholds or Thresholds()
+        self.state = GREEN
+        self.notified = GREEN
+        self.flapping = False
+        self.candidates = deque(maxlen=self.thresholds.window)
+        self.changes = deque()
+
+    def classify(self, up: bool, latency: float):
+        """
+        Function to work out which state one sweep points to, taking the current state into account.
+
+        Parameters
+        ----------
+        up: bool
+            Whether any echo of the sweep was answered.
+        latency: float
+            Rolling latency of the host in ms.
+
+        Returns
+        -------
+        State
+            GREEN, AMBER, RED or DOWN.
+        """
+        t = self.thresholds
+        if not up:
+            return DOWN
+        if latency >= t.red_enter or (self.state == RED and latency >= t.red_exit):
+            return RED
+        if latency > t.amber_enter or (
+            self.state in (AMBER, RED) and latency > t.amber_exit
+        ):
+            return AMBER
+        return GREEN
+
+    def update(self, up: bool, latency: float, now: float = None):
+        """
+        Function to feed one sweep into the state machine.
+
+        Parameters
+        ----------
+        up: bool
+            Whether any echo of the sweep was answered.
+        latency: float
+            Rolling latency of the host in ms.
+        now: float
+            Monotonic time of the sweep, now if None.
+
+        Returns
+        -------
+        int
+            The new state if subscribers should be told about it, -1 if not.
+        """
+        t = self.thresholds
+        if now is None:
+            now = time.monotonic()
+        candidate = self.classify(up, latency)
+        self.candidates.append(candidate)
+        if candidate != self.state and self.candidates.count(candidate) >= t.confirm:
+            self.state = candidate
+            self.changes.append(now)
+
+        while self.changes and self.changes[0] < now - t.flap_window:
+            self.changes.popleft()
+        if len(self.changes) >= t.flap_limit:
+            self.flapping = True
+        elif self.flapping and len(self.changes) <= t.flap_limit // 2:
+            self.flapping = False
+
+        if self.state == self.notified:
+            return -1
+        if self.flapping and DOWN not in (self.state, self.notified):
+            return -1
+        self.notified = self.state
+        return self.state
@@ -1,13 +1,16 @@
-import json
 from ping import Host
+from backends import JsonBackend
+from metrics import PING_RTT, PING_ECHOES, PING_LOST
+
+TOPICS = ("cctv_sub", "status_sub", "down_sub", "broadcast_sub")
 
 
 class Store(object):
     """
-    Store class which stores the hosts and subscribers from JSON files to be used by the bot.
+    Store class which stores the hosts and subscribers from a backend (JSON files by default) to be used by the bot.
     """
 
-    def __init__(self, hosts_file: str, subs_file: str):
+    def __init__(self, hosts_file: str, subs_file: str, backend=None, thresholds=None):
         """
         Initialises the Store class with the hosts and subscribers.
 
@@ -17,30 +20,68 @@ class Store(object):
             The name of the JSON file containing the hosts.
         subs_file: str
             The name of the JSON file containing the subscribers.
+        backend: JsonBackend or SqliteBackend
+            Where to persist the hosts and subscribers, the JSON files if None.
+        thresholds: Thresholds
+            Settings of every host's status state machine, the defaults if None.
         """
         self.hosts_file = hosts_file
         self.subs_file = subs_file
+        self.backend = backend or JsonBackend(hosts_file, subs_file)
+        self.thresholds = thresholds
         self.allhosts = {}
         self.hostobj = {}
         self.subscribers = {}
+        self.topics = {topic: set() for topic in TOPICS}
 
     def load(self):
         """
-        Loads the hosts and subscribers from the JSON files into the Store class.
+        Loads the hosts and subscribers from the backend into the Store class.
         """
-        with open(self.subs_file, "r") as sub_file:
-            jsonSubs = json.load(sub_file)
-        for key, value in jsonSubs.items():
+        hosts, subscribers = self.backend.load()
+        for key, value in subscribers.items():
             self.subscribers[key] = value
+            self.index_subscriber(key)
 
-        with open(self.hosts_file, "r") as hosts_file:
-            self.allhosts = json.load(hosts_file)
+        self.allhosts = dict(hosts)
         for host in self.allhosts:
-            self.hostobj[host] = Host(host, self.allhosts[host])
+            self.hostobj[host] = Host(host, self.allhosts[host], self.thresholds)
+
+    def index_subscriber(self, chatid: str):
+        """
+        Updates the topic index for one subscriber from their subscriptions.
+
+        Parameters
+        ----------
+        chatid: str
+            The chatid of the subscriber to be indexed.
+        """
+        subs = self.subscribers.get(chatid, {})
+        for topic, chatids in self.topics.items():
+            if subs.get(topic):
+                chatids.add(chatid)
+            else:
+                chatids.discard(chatid)
+
+    def chatids(self, topic: str):
+        """
+        Gets the chatids subscribed to a topic from the index.
+
+        Parameters
+        ----------
+        topic: str
+            One of cctv_sub, status_sub, down_sub or broadcast_sub.
+
+        Returns
+        -------
+        set
+            The chatids subscribed to the topic.
+        """
+        return self.topics[topic]
 
     def add_host(self, host: str, ip: str):
         """
-        Adds the hostobjs to the JSON file and the hostobj dictionary.
+        Adds the host to the backend and the hostobj dictionary.
 
         Parameters
         ----------
@@ -50,13 +91,12 @@ class Store(object):
             The IP of the host to be added.
         """
         self.allhosts[host] = ip
-        with open(self.hosts_file, "w") as hosts_file:
-            json.dump(self.allhosts, hosts_file)
-        self.hostobj[host] = Host(host, ip)
+        self.backend.put_host(host, ip)
+        self.hostobj[host] = Host(host, ip, self.thresholds)
 
     def remove_host(self, host: str):
         """
-        Removes the hostobjs from the JSON file and the hostobj dictionary.
+        Removes the host from the backend and the hostobj dictionary.
 
         Parameters
         ----------
@@ -64,9 +104,10 @@ class Store(object):
             The name of the host to be removed.
         """
         del self.allhosts[host]
-        with open(self.hosts_file, "w") as hosts_file:
-            json.dump(self.allhosts, hosts_file)
+        self.backend.delete_host(host)
         del self.hostobj[host]
+        for metric in (PING_RTT, PING_ECHOES, PING_LOST):
+            metric.remove(host)
 
     def add_subscriber(
         self,
@@ -79,7 +120,7 @@ class Store(object):
         },
     ):
         """
-        Adds the subscriber to the JSON file and the subscribers list.
+        Adds the subscriber to the backend and the subscribers list.
 
         Parameters
         ----------
@@ -88,14 +129,14 @@ class Store(object):
         sub_dict: dict
             The dictionary containing the subscription information.
         """
-        # Broadcast is true by default
-        self.subscribers[chatid] = sub_dict
-        with open(self.subs_file, "w") as subs_file:
-            json.dump(self.subscribers, subs_file)
+        # Broadcast is true by default, copied so subscribers don't share one dict
+        self.subscribers[chatid] = dict(sub_dict)
+        self.index_subscriber(chatid)
+        self.backend.put_subscriber(chatid, self.subscribers[chatid])
 
     def remove_subscriber(self, chatid: int):
         """
-        Removes the subscriber from the JSON file and the subscribers list.
+        Removes the subscriber from the backend and the subscribers list.
 
         Parameters
         ----------
@@ -103,8 +144,8 @@ class Store(object):
             The chatid of the subscriber to be removed.
         """
         del self.subscribers[chatid]
-        with open(self.subs_file, "w") as subs_file:
-            json.dump(self.subscribers, subs_file)
+        self.index_subscriber(chatid)
+        self.backend.delete_subscriber(chatid)
 
     def update_subscriptions(self, sub_type, chatid: int, arguments: str):
         """
@@ -132,6 +173,25 @@ class Store(object):
             new_dict["broadcast_sub"] = sub_type
 
         self.subscribers[chatid] = new_dict
+        self.index_subscriber(chatid)
+        self.backend.put_subscriber(chatid, new_dict)
+
+    def set_digest(self, chatid: str, minutes: int):
+        """
+        Sets how many minutes of status notifications a subscriber gets batched into one digest.
+
+        Parameters
+        ----------
+        chatid: str
+            The chatid of the subscriber.
+        minutes: int
+            The digest interval, 0 to send status notifications as they happen.
+        """
+        self.subscribers[chatid]["status_digest"] = minutes
+        self.backend.put_subscriber(chatid, self.subscribers[chatid])
 
-        with open(self.subs_file, "w") as subs_file:
-            json.dump(self.subscribers, subs_file)
+    async def flush(self):
+        """
+        Writes any pending changes to the backend, used on shutdown.
+        """
+        await self.backend.flush()
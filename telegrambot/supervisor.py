@@ -0,0 +1,159 @@
+import time
+import asyncio
+import inspect
+import traceback
+from metrics import TASK_RESTARTS
+
+RESTART_MIN = 1
+RESTART_MAX = 60
+STABLE_AFTER = 60  # seconds a task must run for before its backoff resets
+DEADLINE = 8  # seconds, below Docker's 10 second stop timeout
+RESERVE = 1  # seconds of the deadline kept for the shutdown hooks
+
+
+class Supervisor(object):
+    """
+    Supervisor class which owns the bot's background tasks, restarts any that crash with exponential backoff,
+    and stops them in reverse order on shutdown, draining each one first, all within a deadline.
+    """
+
+    def __init__(self, deadline: float = DEADLINE):
+        """
+        Initialises an empty Supervisor.
+
+        Parameters
+        ----------
+        deadline: float
+            Seconds shutdown may take.
+        """
+        self.deadline = deadline
+        self.factories = {}
+        self.drains = {}
+        self.hooks = []
+        self.tasks = {}
+        self.restarts = {}
+        self.stopping = False
+
+    def add(self, name: str, factory, drain=None):
+        """
+        Adds a task, tasks are started in the order they are added and stopped in reverse.
+
+        Parameters
+        ----------
+        name: str
+            Name of the task.
+        factory: callable
+            Function returning the task's coroutine, called again for each restart.
+        drain: callable
+            Function called with the seconds left before the task is cancelled on shutdown, may be async.
+        """
+        self.factories[name] = factory
+        if drain is not None:
+            self.drains[name] = drain
+
+    def on_shutdown(self, name: str, hook):
+        """
+        Adds a hook run once every task has stopped.
+
+        Parameters
+        ----------
+        name: str
+            Name of the hook.
+        hook: callable
+            Function run on shutdown, may be async.
+        """
+        self.hooks.append((name, hook))
+
+    def start(self, loop=None):
+        """
+        Starts every task.
+
+        Parameters
+        ----------
+        loop: AbstractEventLoop
+            The loop to run the tasks on, the current loop if None.
+        """
+        loop = loop or asyncio.get_event_loop()
+        for name, factory in self.factories.items():
+            self.restarts[name] = 0
+            self.tasks[name] = loop.create_task(self.keep(name, factory))
+
+    async def keep(self, name: str, factory):
+        """
+        Runs a task, restarting it with exponential backoff whenever it crashes.
+
+        Parameters
+        ----------
+        name: str
+            Name of the task.
+        factory: callable
+            Function returning the task's coroutine.
+        """
+        backoff = RESTART_MIN
+        while True:
+            started = time.monotonic()
+            try:
+                await factory()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if time.monotonic() - started > STABLE_AFTER:
+                    backoff = RESTART_MIN
+                print(
+                    f"{name} crashed, restarting in {backoff}s\n{traceback.format_exc()}"
+                )
+            self.restarts[name] += 1
+            TASK_RESTARTS.inc(name)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RESTART_MAX)
+
+    async def run_step(self, name: str, func, *args, timeout: float):
+        """
+        Runs one drain or hook, sync or async, without letting it fail or overrun the shutdown.
+
+        Parameters
+        ----------
+        name: str
+            Name of the step, for logging.
+        func: callable
+            The drain or hook.
+        args:
+            Arguments passed to it.
+        timeout: float
+            Seconds it may take.
+        """
+        try:
+            result = func(*args)
+            if inspect.isawaitable(result):
+                result = await asyncio.wait_for(result, max(timeout, 0.1))
+            if result is False:
+                print(f"Shutdown: {name} did not finish in time")
+        except asyncio.TimeoutError:
+            print(f"Shutdown: {name} did not finish in time")
+        except Exception as e:
+            print(f"Shutdown: {name} failed: {e}")
+
+    async def shutdown(self):
+        """
+        Stops every task in reverse order, draining each first, then runs the shutdown hooks.
+        """
+        if self.stopping:
+            return
+        self.stopping = True
+        end = time.monotonic() + self.deadline
+        print(f"Shutting down, deadline {self.deadline}s")
+        for name in reversed(list(self.tasks)):
+            task = self.tasks[name]
+            if name in self.drains and not task.done():
+                timeout = end - RESERVE - time.monotonic()
+                await self.run_step(
+                    name, self.drains[name], max(timeout, 0), timeout=timeout
+                )
+            task.cancel()
+            await asyncio.wait(
+                [task], timeout=max(end - RESERVE - time.monotonic(), 0.1)
+            )
+        for name, hook in self.hooks:
+            await self.run_step(name, hook, timeout=end - time.monotonic())
+        print("Shutdown complete")
@@ -1,4 +1,239 @@
+import time
+import asyncio
+import datetime
 from telegram import Bot
+from telegram.error import (
+    BadRequest,
+    Forbidden,
+    NetworkError,
+    RetryAfter,
+    TelegramError,
+    TimedOut,
+)
+from telegram.request import HTTPXRequest
+from ratelimit import TokenBucket
+from metrics import NOTIFY_SECONDS, NOTIFY_RESULTS, TELEGRAM_429
+
+POOL_SIZE = 32
+GLOBAL_RATE = 30  # messages per second across all chats
+PRIVATE_CHAT_RATE = 1  # messages per second to one private chat
+GROUP_CHAT_RATE = 20 / 60  # messages per second to one group chat
+RETRIES = 3
+MAX_RETRY_AFTER = 60
+notifiers = {}
+background = set()
+
+SENT = "sent"
+FAILED = "failed"
+THROTTLED = "throttled"
+UNREACHABLE = "unreachable"  # Telegram could not be reached, worth trying again later
+
+
+class DeliveryReport(object):
+    """
+    DeliveryReport class which records which chats a notification reached.
+    """
+
+    def __init__(self):
+        """
+        Initialises an empty DeliveryReport.
+        """
+        self.sent = []
+        self.failed = []
+        self.throttled = []
+        self.unreachable = []
+
+    def add(self, chatid, result: str):
+        """
+        Adds the result of sending to one chat.
+
+        Parameters
+        ----------
+        chatid: str
+            The chat ID the message was sent to.
+        result: str
+            One of SENT, FAILED, THROTTLED or UNREACHABLE.
+        """
+        getattr(self, result).append(chatid)
+
+    def __str__(self):
+        return (
+            f"{len(self.sent)} sent, {len(self.failed)} failed, "
+            f"{len(self.throttled)} throttled, {len(self.unreachable)} unreachable"
+        )
+
+
+class Notifier(object):
+    """
+    Notifier class which keeps one bot, and with it one pooled keep-alive HTTP session, for the life of the process.
+    """
+
+    def __init__(self, bot: Bot):
+        """
+        Initialises the Notifier with the bot used to send every notification.
+
+        Parameters
+        ----------
+        bot: Bot
+            The bot to send messages with, usually the running Application's bot.
+        """
+        self.bot = bot
+        self.outbox = None
+        self.bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self.chat_buckets = {}
+
+    def chat_bucket(self, chatid):
+        """
+        Gets the rate limit bucket of a chat, group chats have negative IDs and a lower limit.
+
+        Parameters
+        ----------
+        chatid: str
+            The chat ID.
+
+        Returns
+        -------
+        TokenBucket
+            The chat's bucket.
+        """
+        if chatid not in self.chat_buckets:
+            if int(chatid) < 0:
+                self.chat_buckets[chatid] = TokenBucket(GROUP_CHAT_RATE, 20)
+            else:
+                self.chat_buckets[chatid] = TokenBucket(PRIVATE_CHAT_RATE, 1)
+        return self.chat_buckets[chatid]
+
+    async def send(self, chatid, msg: str):
+        """
+        Function to send a message to one chat, recording how long it took and how it went.
+
+        Parameters
+        ----------
+        chatid: str
+            The chat ID.
+        msg: str
+            The message to send.
+
+        Returns
+        -------
+        str
+            SENT, FAILED, THROTTLED or UNREACHABLE.
+        """
+        start = time.perf_counter()
+        result = await self.deliver(chatid, msg)
+        NOTIFY_SECONDS.observe(time.perf_counter() - start)
+        NOTIFY_RESULTS.inc(result)
+        return result
+
+    async def deliver(self, chatid, msg: str):
+        """
+        Function to send a message to one chat within Telegram's rate limits,
+        waiting out flood control and retrying transient network errors.
+        Only errors which sending again cannot fix, such as a blocked bot, return FAILED.
+
+        Parameters
+        ----------
+        chatid: str
+            The chat ID.
+        msg: str
+            The message to send.
+
+        Returns
+        -------
+        str
+            SENT, FAILED, THROTTLED or UNREACHABLE.
+        """
+        result = FAILED
+        for attempt in range(RETRIES + 1):
+            await self.chat_bucket(chatid).acquire()
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(int(chatid), text=msg)
+                return SENT
+            except RetryAfter as e:
+                TELEGRAM_429.inc()
+                retry_after = e.retry_after
+                if isinstance(retry_after, datetime.timedelta):
+                    retry_after = retry_after.total_seconds()
+                print(f"Flood control sending to {chatid}, retry in {retry_after}s")
+                result = THROTTLED
+                if retry_after > MAX_RETRY_AFTER:
+                    break
+                self.bucket.pause(retry_after)
+            except (BadRequest, Forbidden) as e:
+                print(f"Could not send to {chatid}: {e}")
+                return FAILED
+            except (NetworkError, TimedOut) as e:
+                print(f"Network error sending to {chatid}: {e}")
+                result = UNREACHABLE
+                if attempt < RETRIES:
+                    await asyncio.sleep(2**attempt)
+            except TelegramError as e:
+                print(f"Could not send to {chatid}: {e}")
+                return FAILED
+        return result
+
+    async def notify(self, msg: str, chatids):
+        """
+        Function to send a message to all chat IDs in parallel over the shared session.
+
+        Parameters
+        ----------
+        msg: str
+            The specified message to be broadcasted to all subscribers.
+        chatids: list
+            List of chat IDs.
+
+        Returns
+        -------
+        DeliveryReport
+            Which chats the message was sent to, failed for, was throttled for or could not reach Telegram for.
+        """
+        chatids = list(chatids)
+        results = await asyncio.gather(*(self.send(chatid, msg) for chatid in chatids))
+        report = DeliveryReport()
+        for chatid, result in zip(chatids, results):
+            report.add(chatid, result)
+        return report
+
+
+def register_bot(bot: Bot):
+    """
+    Registers a bot, such as the Application's bot, as the notifier for its token.
+
+    Parameters
+    ----------
+    bot: Bot
+        The bot to be shared by every notify call with the same token.
+
+    Returns
+    -------
+    Notifier
+        The notifier wrapping the bot.
+    """
+    notifiers[bot.token] = Notifier(bot)
+    return notifiers[bot.token]
+
+
+def get_notifier(TOKEN):
+    """
+    Gets the shared notifier for a token, creating a pooled bot the first time if none was registered.
+
+    Parameters
+    ----------
+    TOKEN: Final
+        The bot token.
+
+    Returns
+    -------
+    Notifier
+        The shared notifier for the token.
+    """
+    if TOKEN not in notifiers:
+        bot = Bot(token=TOKEN, request=HTTPXRequest(connection_pool_size=POOL_SIZE))
+        notifiers[TOKEN] = Notifier(bot)
+    return notifiers[TOKEN]
+
 
 async def notify(msg: str, chatids, TOKEN):
     """
@@ -7,11 +242,37 @@ async def notify(msg: str, chatids, TOKEN):
     ----------
     msg: str
         The specified message to be broadcasted to all subscribers.
-    subscribers: list
-        List of subscribers.
+    chatids: list
+        List of chat IDs.
+    TOKEN: Final
+        The bot token.
+
+    Returns
+    -------
+    DeliveryReport
+        Which chats the message was sent to, failed for, or was throttled for.
+    """
+    return await get_notifier(TOKEN).notify(msg, chatids)
+
+
+def queue_notify(msg: str, chatids, TOKEN):
+    """
+    Queues a message for all subscribers without waiting for it to be delivered.
+    Goes through the notifier's outbox when one is attached, so the message survives a restart.
+
+    Parameters
+    ----------
+    msg: str
+        The specified message to be broadcasted to all subscribers.
+    chatids: list
+        List of chat IDs.
     TOKEN: Final
         The bot token.
     """
-    bot = Bot(token=TOKEN)
-    for chatid in chatids:
-        await bot.send_message(int(chatid), text=msg)
\ No newline at end of file
+    notifier = get_notifier(TOKEN)
+    if notifier.outbox is not None:
+        notifier.outbox.put(msg, chatids)
+    else:
+        task = asyncio.get_running_loop().create_task(notifier.notify(msg, chatids))
+        background.add(task)
+        task.add_done_callback(background.discard)
@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from metrics import LOOP_LAG, LOOP_LAG_SECONDS, LOOP_STALLS
+
+THRESHOLD = 0.25
+INTERVAL = 0.05
+SAMPLE_INTERVAL = 0.005
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Watchdog(object):
+    """
+    Watchdog class which measures event loop lag from a heartbeat and, from a separate thread,
+    logs the stack the loop is stuck in whenever it stops beating for longer than a threshold.
+    The same thread can sample the loop's stack for a while to profile where its time goes.
+    """
+
+    def __init__(
+        self,
+        threshold: float = THRESHOLD,
+        interval: float = INTERVAL,
+        sample_interval: float = SAMPLE_INTERVAL,
+        targets: dict = None,
+    ):
+        """
+        Initialises the Watchdog.
+
+        Parameters
+        ----------
+        threshold: float
+            Seconds the loop must be blocked for before its stack is logged.
+        interval: float
+            Seconds between heartbeats.
+        sample_interval: float
+            Seconds between stack samples while profiling.
+        targets: dict
+            Functions whose samples are reported separately, by label.
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.sample_interval = sample_interval
+        self.codes = {func.__code__: label for label, func in (targets or {}).items()}
+        self.beat = time.monotonic()
+        self.loop_thread = None
+        self.stalled = False
+        self.stalls = 0
+        self.profiling_until = 0
+        self.switch_interval = None
+        self.samples = {}
+        self.total = 0
+
+    async def run(self):
+        """
+        Beats the heartbeat and records the loop lag until cancelled, starting the watching thread first.
+        The thread stops with it, so the loop closing is not reported as a stall, and any profiling stops
+        so the process-wide GIL switch interval is put back straight away.
+        """
+        self.loop_thread = threading.get_ident()
+        threading.Thread(target=self.watch, name="watchdog", daemon=True).start()
+        try:
+            while True:
+                start = time.perf_counter()
+                self.beat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, time.perf_counter() - start - self.interval)
+                LOOP_LAG.set(lag)
+                LOOP_LAG_SECONDS.observe(lag)
+        finally:
+            self.loop_thread = None
+            self.stop_profiling()
+
+    def watch(self):
+        """
+        Watching thread which logs the loop's stack once per stall and takes samples while profiling,
+        until the heartbeat stops.
+        """
+        while self.loop_thread is not None:
+            profiling = time.monotonic() < self.profiling_until
+            if not profiling and self.switch_interval is not None:
+                self.restore_switch_interval()
+            time.sleep(self.sample_interval if profiling else self.interval)
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            if profiling:
+                self.sample(frame)
+            blocked = time.monotonic() - self.beat - self.interval
+            if blocked < self.threshold or self.loop_thread is None:
+                self.stalled = False
+            elif not self.stalled:
+                self.stalled = True
+                self.stalls += 1
+                LOOP_STALLS.inc()
+                stack = "".join(traceback.format_stack(frame))
+                print(f"Event loop blocked for {round(blocked * 1000)} ms in:\n{stack}")
+        self.restore_switch_interval()
+
+    def sample(self, frame):
+        """
+        Counts one sample of the loop's stack against the innermost target function on it,
+        and against the innermost line of the bot's own code.
+
+        Parameters
+        ----------
+        frame: frame
+            The frame the loop thread is running.
+        """
+        label = None
+        line = None
+        leaf = frame
+        while frame is not None:
+            code = frame.f_code
+            if line is None and code.co_filename.startswith(SOURCE_DIR):
+                line = f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}"
+            if code in self.codes:
+                label = self.codes[code]
+                break
+            frame = frame.f_back
+        if label is None:
+            # The loop waiting in select has nothing to do
+            label = "idle" if leaf.f_code.co_name == "select" else "other"
+        if line is None:
+            line = f"{os.path.basename(leaf.f_code.co_filename)}:{leaf.f_lineno} {leaf.f_code.co_name}"
+        lines = self.samples.setdefault(label, {})
+        lines[line] = lines.get(line, 0) + 1
+        self.total += 1
+
+    def start_profiling(self, seconds: float):
+        """
+        Clears the samples and samples the loop for a while.
+
+        Parameters
+        ----------
+        seconds: float
+            How long to sample for.
+        """
+        self.samples = {}
+        self.total = 0
+        if self.switch_interval is None:
+            self.switch_interval = sys.getswitchinterval()
+        # The loop thread must hand over the GIL often enough for short callbacks to be sampled
+        sys.setswitchinterval(min(self.switch_interval, self.sample_interval / 10))
+        self.profiling_until = time.monotonic() + seconds
+
+    def stop_profiling(self):
+        """
+        Stops sampling, keeping the samples taken so far.
+        """
+        self.profiling_until = 0
+        self.restore_switch_interval()
+
+    def restore_switch_interval(self):
+        """
+        Puts back the GIL switch interval that was in use before profiling.
+        """
+        switch_interval, self.switch_interval = self.switch_interval, None
+        if switch_interval is not None:
+            sys.setswitchinterval(switch_interval)
+
+    def profiling(self):
+        """
+        Returns
+        -------
+        bool
+            True while the loop is being sampled.
+        """
+        return time.monotonic() < self.profiling_until
+
+    def report(self, top: int = 5):
+        """
+        Function to summarise the samples.
+
+        Parameters
+        ----------
+        top: int
+            Number of lines shown for each target.
+
+        Returns
+        -------
+        str
+            The share of samples in each target and its busiest lines.
+        """
+        if self.total == 0:
+            return "No samples"
+        report = f"{self.total} samples, {self.stalls} stalls over {self.threshold}s"
+        for label, lines in sorted(
+            self.samples.items(), key=lambda item: -sum(item[1].values())
+        ):
+            count = sum(lines.values())
+            report += f"\n\n{label}: {round(count / self.total * 100, 1)}%"
+            for line, hits in sorted(lines.items(), key=lambda item: -item[1])[:top]:
+                report += f"\n    {round(hits / self.total * 100, 1)}% {line}"
+        return report
@@ -0,0 +1,61 @@
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "telegrambot"),
+)
+
+from ping import Host
+from scheduler import Scheduler
+
+
+def healthy_host(name: str = "host"):
+    host = Host(name, "127.0.0.1")
+    host.status.candidates.append(host.status.state)
+    return host
+
+
+def test_healthy_host_backs_off_to_max_interval():
+    scheduler = Scheduler(5.0, 10.0, 60.0, backoff_after=6, jitter=0)
+    host = healthy_host()
+    scheduler.sync({host.host_name: host}, now=0)
+    intervals = []
+    for i in range(24):
+        scheduler.reschedule(host, now=i)
+        intervals.append(scheduler.due[host.host_name] - i)
+    assert intervals[:5] == [10.0] * 5
+    assert intervals[5:11] == [20.0] * 6
+    assert intervals[-1] == 60.0
+
+
+def test_many_reschedules_do_not_overflow():
+    # Intervals are parsed as floats, so an unbounded streak would overflow 2 ** n
+    scheduler = Scheduler(5.0, 10.0, 60.0, backoff_after=6, jitter=0)
+    host = healthy_host()
+    scheduler.sync({host.host_name: host}, now=0)
+    for i in range(20000):
+        scheduler.reschedule(host, now=i)
+    assert scheduler.due[host.host_name] - i == 60.0
+    assert scheduler.streaks[host.host_name] < 18
+
+
+def test_sync_restores_hosts_popped_but_not_rescheduled():
+    # Such as when a sweep raised between pop_due and reschedule
+    scheduler = Scheduler(5.0, 10.0, 60.0, jitter=0)
+    hosts = {name: healthy_host(name) for name in ("a", "b")}
+    scheduler.sync(hosts, now=0)
+    assert sorted(scheduler.pop_due(now=10)) == ["a", "b"]
+    assert scheduler.next_due() is None
+    scheduler.sync(hosts, now=10)
+    assert sorted(scheduler.pop_due(now=20)) == ["a", "b"]
+
+
+def test_removed_host_is_not_rescheduled():
+    scheduler = Scheduler(5.0, 10.0, 60.0, jitter=0)
+    host = healthy_host()
+    scheduler.sync({host.host_name: host}, now=0)
+    scheduler.pop_due(now=10)
+    scheduler.sync({}, now=10)
+    scheduler.reschedule(host, now=10)
+    assert scheduler.next_due() is None